@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Rendu en lot de bibliothèques de partitions .txt, pour chaque instrument, sur un pool de processus.
+Une partition à plusieurs pistes (lignes TRACK) porte ses propres instruments : elle est rendue une
+seule fois, pistes mixées avec leur gain, dans <nom>.wav.
+Les workers écrivent leur rendu dans une mémoire partagée allouée par le processus principal,
+au lieu de renvoyer de gros tableaux NumPy picklés. Seuls quelques rendus sont en cours à la fois :
+chaque segment est alloué au lancement de son rendu et libéré dès que son WAV est écrit.
+
+    python batch_render.py scores/ -o renders/ --workers 4 --report throughput.json
+"""
+
+import os
+import glob
+import json
+import time
+import argparse
+from collections import deque
+from multiprocessing import Pool, shared_memory, resource_tracker
+
+import numpy as np
+
+from instrument import INSTRUMENTS
+from render import OfflineRenderer, NOTE_LENGTH, write_wav, render_tracks
+from score import load_score, load_tracks, is_multitrack
+
+_renderer = None
+
+
+def _init_worker(note_length, gain):
+    # Un renderer par processus : les notes déjà rendues servent aux partitions suivantes
+    global _renderer
+    _renderer = OfflineRenderer(note_length=note_length, gain=gain)
+
+
+def _render_job(job):
+    # `tracks` : liste de score.Track pour une partition à plusieurs pistes, sinon None
+    events, tracks, shm_name, capacity = job
+    # Les workers partagent le resource tracker du processus principal, qui libère le segment
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray((capacity,), dtype=np.float32, buffer=shm.buf)
+        if tracks is None:
+            frames = _renderer.render_into(events, out)
+        else:
+            mix = render_tracks(tracks, _renderer.player, _renderer.note_length, _renderer.gain)
+            frames = len(mix)
+            out[:frames] = mix
+            del mix
+        del out
+    finally:
+        shm.close()
+    return frames
+
+
+def find_scores(paths):
+    scores = []
+    for path in paths:
+        if os.path.isdir(path):
+            scores.extend(sorted(glob.glob(os.path.join(path, "*.txt"))))
+        else:
+            scores.append(path)
+    return scores
+
+
+def batch_render(scores, output_dir, instruments=INSTRUMENTS, workers=None, note_length=NOTE_LENGTH, gain=0.25):
+    os.makedirs(output_dir, exist_ok=True)
+    sizing = OfflineRenderer(note_length=note_length, gain=gain)
+    sample_rate = sizing.sample_rate
+
+    workers = workers or os.cpu_count()
+    # Rendus en cours au plus : de quoi occuper chaque worker pendant que le principal écrit les WAV.
+    # La mémoire partagée utilisée ne dépend donc pas de la taille de la bibliothèque.
+    max_in_flight = 2 * workers
+
+    def jobs():
+        # Le processus principal lit chaque partition au moment de lancer son rendu
+        for path in scores:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if is_multitrack(path):
+                yield None, load_tracks(path), os.path.join(output_dir, f"{stem}.wav")
+                continue
+            for instrument in instruments:
+                yield load_score(path, instrument), None, os.path.join(output_dir, f"{stem}_{instrument}.wav")
+
+    start = time.perf_counter()
+    audio_seconds = 0.0
+    notes = 0
+    renders = 0
+    in_flight = deque()  # (résultat, segment, capacité, fichier de sortie, nombre de notes)
+
+    def finish():
+        nonlocal audio_seconds, notes, renders
+        result, shm, capacity, output, count = in_flight.popleft()
+        try:
+            frames = result.get()
+            mix = np.ndarray((capacity,), dtype=np.float32, buffer=shm.buf)[:frames]
+            write_wav(output, [mix], sample_rate)
+            del mix
+        finally:
+            shm.close()
+            shm.unlink()
+        audio_seconds += frames / sample_rate
+        notes += count
+        renders += 1
+
+    # Les segments sont créés après le démarrage du pool : le resource tracker doit déjà tourner pour
+    # que les workers partagent celui du processus principal au lieu d'en lancer un chacun
+    resource_tracker.ensure_running()
+    with Pool(workers, initializer=_init_worker, initargs=(note_length, gain)) as pool:
+        try:
+            for events, tracks, output in jobs():
+                if len(in_flight) >= max_in_flight:
+                    finish()
+                if tracks is None:
+                    capacity = max(sizing.length(events), 1)
+                    count = len(events)
+                else:
+                    capacity = max(max(sizing.length(track.events) for track in tracks), 1)
+                    count = sum(len(track) for track in tracks)
+                shm = shared_memory.SharedMemory(create=True, size=capacity * 4)
+                try:
+                    result = pool.apply_async(_render_job, ((events, tracks, shm.name, capacity),))
+                except BaseException:
+                    shm.close()
+                    shm.unlink()
+                    raise
+                in_flight.append((result, shm, capacity, output, count))
+            while in_flight:
+                finish()
+        finally:
+            # Erreur en route : les segments encore alloués sont libérés quand même
+            for _, shm, _, _, _ in in_flight:
+                shm.close()
+                shm.unlink()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "scores": len(scores),
+        "renders": renders,
+        "instruments": list(instruments),
+        "workers": workers,
+        "notes": notes,
+        "wall_seconds": elapsed,
+        "audio_seconds": audio_seconds,
+        "scores_per_second": len(scores) / elapsed if elapsed else 0.0,
+        "renders_per_second": renders / elapsed if elapsed else 0.0,
+        "audio_seconds_per_wall_second": audio_seconds / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render whole score libraries to WAV for every instrument.")
+    parser.add_argument("scores", nargs="+", help=".txt scores or directories containing them")
+    parser.add_argument("-o", "--output", default="renders", help="output directory")
+    parser.add_argument("-i", "--instrument", action="append", choices=INSTRUMENTS,
+                        help="instrument to render (repeatable, default: all)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--gain", type=float, default=0.25)
+    parser.add_argument("--note-length", type=float, default=NOTE_LENGTH)
+    parser.add_argument("--report", help="write the throughput report to this JSON file")
+    args = parser.parse_args(argv)
+
+    scores = find_scores(args.scores)
+    if not scores:
+        parser.error("no score found")
+
+    report = batch_render(scores, args.output, args.instrument or INSTRUMENTS, args.workers,
+                          args.note_length, args.gain)
+    print(f"{report['renders']} renders of {report['scores']} scores with {report['workers']} workers "
+          f"in {report['wall_seconds']:.2f}s")
+    print(f"{report['scores_per_second']:.2f} scores/s, "
+          f"{report['audio_seconds_per_wall_second']:.0f} audio-seconds per wall-second")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks reproductibles des chemins critiques de synthèse et de lecture, sans carte son
+(pilote audio SDL "dummy") et sans interface.
+
+    python benchmark.py -o baseline.json                   # mesure et sauvegarde
+    python benchmark.py -o current.json --compare baseline.json --threshold 0.2
+
+Avec --compare, chaque mesure plus lente que la référence de plus de `threshold` (20 % par défaut)
+est signalée comme régression et le code de sortie vaut 1.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+from datetime import datetime
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+
+from instrument import MusicPlayer
+from drums import DrumKit, StepSequencer
+from midi import load_midi, write_midi
+from render import OfflineRenderer
+from score import load_score, compile_score
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCORES = ("mario.txt", "bella_ciao.txt")
+
+
+def measure(func, repeat=20, warmup=2):
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "runs": repeat,
+        "min_ms": times[0],
+        "median_ms": times[len(times) // 2],
+        "max_ms": times[-1],
+    }
+
+
+def benchmarks(player, cache_dir):
+    # (nom, fonction, nombre de répétitions)
+    def uncached(play):
+        # Vide le cache pour mesurer la synthèse complète, pas un simple Sound.play()
+        def run():
+            player.tone_cache.clear()
+            play(440, 1.0)
+        return run
+
+    tone = player.render_piano_tone(440, 1.0)
+    yield "play_piano_tone", uncached(player.play_piano_tone), 30
+    yield "play_xylophone_tone", uncached(player.play_xylophone_tone), 30
+    yield "play_videoGame_tone", uncached(player.play_videoGame_tone), 30
+    yield "play_guitar_tone", uncached(player.play_guitar_tone), 30
+    chord = [98.0, 123.47, 146.83, 196.0, 246.94, 392.0]
+    yield "render_strum", lambda: player.render_strum(chord, 1.0), 30
+
+    kit = DrumKit(player.sample_rate, cache_dir)
+    kit.load()
+    drums = StepSequencer(kit)
+    for step in range(0, drums.steps, 2):
+        drums.set_step("closed_hat", step)
+    drums.set_step("kick", 0)
+    drums.set_step("snare", 4)
+
+    def mix_bar():
+        drums._bars.clear()
+        drums.bar()
+    yield "drum_bar_mix", mix_bar, 50
+    yield "drum_bar_cached", drums.bar, 200
+    yield "play_piano_tone_cached", lambda: player.play_piano_tone(440, 1.0), 200
+    yield "create_envelope", lambda: player.create_envelope(44100, 0.01, 0.1, 0.3, 0.1), 200
+    yield "stereo_int16_conversion", lambda: player._to_stereo_int16(tone), 200
+    out = np.empty((len(tone), 2), dtype=np.int16)
+    yield "stereo_int16_conversion_into", lambda: player._to_stereo_int16(tone, out), 200
+
+    for name in SCORES:
+        path = os.path.join(HERE, name)
+        stem = os.path.splitext(name)[0]
+        yield f"parse_score[{stem}]", lambda path=path: load_score(path), 50
+        yield f"compile_score[{stem}]", lambda path=path: compile_score(path, cache_dir=None), 50
+        yield f"compile_score_cached[{stem}]", lambda path=path: compile_score(path, cache_dir=cache_dir), 50
+        events = load_score(path)
+        # Nouveau renderer à chaque fois : synthèse des notes comprise
+        yield f"offline_render[{stem}]", lambda events=events: OfflineRenderer(player).render(events), 10
+        # Fichier de référence écrit avant les mesures : midi_import peut être sélectionné seul
+        midi_path = os.path.join(cache_dir, f"{stem}.mid")
+        write_midi(midi_path, events)
+        yield f"midi_export[{stem}]", lambda events=events, midi_path=midi_path: write_midi(midi_path, events), 50
+        yield f"midi_import[{stem}]", lambda midi_path=midi_path: load_midi(midi_path), 50
+
+
+def run(selected=None):
+    player = MusicPlayer()
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, func, repeat in benchmarks(player, cache_dir):
+            if selected and not any(pattern in name for pattern in selected):
+                continue
+            results[name] = measure(func, repeat)
+            print(f"{name:36s} median {results[name]['median_ms']:9.3f} ms   min {results[name]['min_ms']:9.3f} ms")
+    player.close()
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    regressions = []
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        ratio = result["median_ms"] / reference["median_ms"] if reference["median_ms"] else 1.0
+        status = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"{name:36s} {reference['median_ms']:9.3f} -> {result['median_ms']:9.3f} ms  x{ratio:5.2f}  {status}")
+        if status != "ok":
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the synthesis and playback hot paths.")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="where to save the results (JSON)")
+    parser.add_argument("--compare", help="baseline results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown of the median flagged as a regression (default 0.2 = 20%%)")
+    parser.add_argument("-k", "--select", action="append", help="only run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    current = run(args.select)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
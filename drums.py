@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Boîte à rythmes : des sons percussifs synthétisés une seule fois et rangés dans une banque .npy
+(int16 stéréo, une ligne par son) relue en memory-map. Un coup de pad joue directement une ligne
+de la banque : aucun décodage au déclenchement, et les pages sont partagées entre processus.
+
+Le séquenceur pas à pas pré-mixe chaque mesure de son motif dans un buffer, gardé en cache et
+bouclé par le lecteur : une fois la première mesure mixée, la boucle ne coûte presque plus rien.
+
+    python drums.py                  # (re)construit drums.npy dans la banque de l'application
+    python drums.py mon_dossier      # ... ou dans un autre dossier
+"""
+
+import os
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+from instrument import MemmapBank, user_cache_dir
+
+# Sons du kit et leur note General MIDI (canal percussions)
+DRUM_SOUNDS = OrderedDict([
+    ("kick", "C2"),
+    ("snare", "D2"),
+    ("clap", "D#2"),
+    ("closed_hat", "F#2"),
+    ("tom", "A2"),
+    ("open_hat", "A#2"),
+])
+SAMPLE_LENGTH = 0.5  # secondes par son
+SAMPLE_PEAK = 0.8  # les sons sont normalisés un peu sous la pleine échelle
+BANK_VERSION = 1
+# Dossier lu par l'application (QStandardPaths.GenericCacheLocation/PyQtPiano/sample_bank)
+DEFAULT_BANK_DIR = user_cache_dir("PyQtPiano", "sample_bank")
+
+
+def synthesize(name, sample_rate=44100, length=SAMPLE_LENGTH, seed=0):
+    # Un son du kit, mono float64 normalisé à SAMPLE_PEAK
+    num_samples = int(sample_rate * length)
+    t = np.arange(num_samples) / sample_rate
+    noise = np.random.default_rng(seed).uniform(-1, 1, num_samples)
+    if name == "kick":
+        phase = 2 * np.pi * np.cumsum(50 + 100 * np.exp(-t * 30)) / sample_rate
+        sound = np.sin(phase) * np.exp(-t * 8)
+    elif name == "snare":
+        sound = 0.7 * noise * np.exp(-t * 20) + 0.5 * np.sin(2 * np.pi * 180 * t) * np.exp(-t * 15)
+    elif name == "clap":
+        # Trois claquements rapprochés puis une courte queue
+        sound = np.zeros(num_samples)
+        for offset in (0.0, 0.01, 0.02):
+            burst = t >= offset
+            sound[burst] += np.exp(-(t[burst] - offset) * 120)
+        sound = noise * (sound + 0.4 * np.exp(-t * 18))
+    elif name in ("closed_hat", "open_hat"):
+        # Bruit passe-haut (différence première) : métallique et brillant
+        bright = np.diff(noise, prepend=0.0)
+        sound = bright * np.exp(-t * (60 if name == "closed_hat" else 10))
+    elif name == "tom":
+        phase = 2 * np.pi * np.cumsum(90 + 30 * np.exp(-t * 20)) / sample_rate
+        sound = np.sin(phase) * np.exp(-t * 10)
+    else:
+        raise ValueError(f"Unknown drum sound: {name}")
+    peak = np.abs(sound).max()
+    return sound * (SAMPLE_PEAK / peak) if peak else sound
+
+
+class DrumKit:
+    # Banque des sons du kit : synthétisée et sauvée au premier lancement, relue en memory-map ensuite
+
+    def __init__(self, sample_rate=44100, directory=None, length=SAMPLE_LENGTH):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.length = length
+        self.sounds = list(DRUM_SOUNDS)
+        self.index = {name: i for i, name in enumerate(self.sounds)}
+        self.notes = {note: name for name, note in DRUM_SOUNDS.items()}
+        self.bank = None
+        self.store = MemmapBank(directory, "drums.json", {
+            "version": BANK_VERSION,
+            "sample_rate": sample_rate,
+            "length": length,
+            "sounds": self.sounds,
+        })
+
+    def load(self):
+        if self.bank is not None:
+            return self.bank
+        if self.store.header_matches():
+            self.bank = self.store.open("drums")
+        if self.bank is None:
+            self.bank = self.render()
+            self.store.write_header()
+        return self.bank
+
+    def render(self):
+        shape = (len(self.sounds), int(self.sample_rate * self.length), 2)
+        return self.store.create("drums", shape, self._fill)
+
+    def _fill(self, bank):
+        for i, name in enumerate(self.sounds):
+            sound = synthesize(name, self.sample_rate, self.length, seed=i)
+            np.multiply(sound, 32767, out=bank[i, :, 0], casting='unsafe')
+            bank[i, :, 1] = bank[i, :, 0]
+
+    def sample(self, name):
+        # Ligne int16 stéréo de la banque (vue sur le memmap, rien n'est copié)
+        return self.load()[self.index[name]]
+
+    def sound_for_note(self, note):
+        # Nom du son pour une note General MIDI ("C2" -> "kick"), None sinon
+        return self.notes.get(note)
+
+
+class StepSequencer:
+    # Motif pas à pas (sons x pas). Chaque mesure est pré-mixée une fois en int16 stéréo et gardée
+    # en cache par contenu du motif et tempo : rejouer, boucler ou revenir à un motif déjà entendu
+    # ne remixe rien.
+
+    def __init__(self, kit, steps=16, bpm=120, steps_per_beat=4, gain=0.5, max_bars=16):
+        self.kit = kit
+        self.steps = steps
+        self.bpm = bpm
+        self.steps_per_beat = steps_per_beat
+        self.gain = gain
+        self.max_bars = max_bars
+        self.pattern = np.zeros((len(kit.sounds), steps), dtype=bool)
+        self._bars = OrderedDict()
+        self._accumulator = None
+        self.mixes = 0
+
+    @property
+    def step_samples(self):
+        return int(round(self.kit.sample_rate * 60.0 / (self.bpm * self.steps_per_beat)))
+
+    @property
+    def bar_samples(self):
+        return self.step_samples * self.steps
+
+    @property
+    def bar_seconds(self):
+        return self.bar_samples / self.kit.sample_rate
+
+    def set_step(self, sound, step, on=True):
+        self.pattern[self.kit.index[sound], step] = on
+
+    def toggle(self, sound, step):
+        row = self.kit.index[sound]
+        self.pattern[row, step] = not self.pattern[row, step]
+        return bool(self.pattern[row, step])
+
+    def clear(self):
+        self.pattern[:] = False
+
+    def set_bpm(self, bpm):
+        self.bpm = bpm
+
+    def bar(self):
+        # Buffer int16 stéréo d'une mesure du motif courant, mixé au plus une fois
+        key = (self.pattern.tobytes(), self.bpm)
+        bar = self._bars.get(key)
+        if bar is None:
+            bar = self._mix_bar()
+            self._bars[key] = bar
+            if len(self._bars) > self.max_bars:
+                self._bars.popitem(last=False)
+        else:
+            self._bars.move_to_end(key)
+        return bar
+
+    def _mix_bar(self):
+        bank = self.kit.load()
+        bar_samples = self.bar_samples
+        step_samples = self.step_samples
+        # Accumulateur float32 réutilisé tant que la longueur de mesure ne change pas
+        if self._accumulator is None or len(self._accumulator) != bar_samples:
+            self._accumulator = np.empty(bar_samples, dtype=np.float32)
+        mix = self._accumulator
+        mix.fill(0)
+
+        for row, step in zip(*np.nonzero(self.pattern)):
+            sample = bank[row, :, 0]
+            start = step * step_samples
+            # La fin d'un son qui dépasse la mesure est repliée au début : la boucle est continue
+            position = 0
+            while position < len(sample):
+                n = min(len(sample) - position, bar_samples - start)
+                mix[start:start + n] += sample[position:position + n]
+                position += n
+                start = 0
+
+        mix *= self.gain
+        np.clip(mix, -32768, 32767, out=mix)
+        bar = np.empty((bar_samples, 2), dtype=np.int16)
+        np.copyto(bar[:, 0], mix, casting='unsafe')
+        bar[:, 1] = bar[:, 0]
+        self.mixes += 1
+        return bar
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the memory-mapped drum sample bank.")
+    parser.add_argument("directory", nargs="?", default=DEFAULT_BANK_DIR,
+                        help=f"bank directory (default: {DEFAULT_BANK_DIR}, the one the app reads)")
+    args = parser.parse_args(argv)
+
+    kit = DrumKit(directory=args.directory)
+    for name in ("drums.json", "drums.npy"):
+        path = os.path.join(args.directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    kit.load()
+    print(f"{os.path.join(args.directory, 'drums.npy')}: {len(kit.sounds)} sounds")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,169 +5,1151 @@ Created on Sat Apr 27 14:42:36 2024
 @author: laure
 """
 
-import pygame
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+
 import numpy as np
-from scipy.signal import lfilter, bilinear, lfilter_zi
-
-note_to_frequency = {
-    "Do" : (261,523,1046),
-    "Do#" : (277,554,1108),
-    "Ré" : (293,587,1174),
-    "Ré#" : (311,622,1244),
-    "Mi" : (329,659,1318),
-    "Fa" : (349,698,1396),
-    "Fa#" : (369,739,1479),
-    "Sol" : (392,783,1568),
-    "Sol#" : (415,830,1661),
-    "La" : (440,880,1760),
-    "La#" : (477,932,1864),
-    "Si" : (496,987,1975),
-    "B0": 31,
-    "C1": 33,
-    "C#1": 35,  # or "Db1": 35
-    "D1": 37,
-    "D#1": 39,  # or "Eb1": 39
-    "E1": 41,
-    "F1": 44,
-    "F#1": 46,  # or "Gb1": 46
-    "G1": 49,
-    "G#1": 52,  # or "Ab1": 52
-    "A1": 55,
-    "A#1": 58,  # or "Bb1": 58
-    "B1": 62,
-    "C2": 65,
-    "C#2": 69,  # or "Db2": 69
-    "D2": 73,
-    "D#2": 78,  # or "Eb2": 78
-    "E2": 82,
-    "F2": 87,
-    "F#2": 93,  # or "Gb2": 93
-    "G2": 98,
-    "G#2": 104,  # or "Ab2": 104
-    "A2": 110,
-    "A#2": 117,  # or "Bb2": 117
-    "B2": 123,
-    "C3": 131,
-    "C#3": 139,  # or "Db3": 139
-    "D3": 147,
-    "D#3": 156,  # or "Eb3": 156
-    "E3": 165,
-    "F3": 175,
-    "F#3": 185,  # or "Gb3": 185
-    "G3": 196,
-    "G#3": 208,  # or "Ab3": 208
-    "A3": 220,
-    "A#3": 233,  # or "Bb3": 233
-    "B3": 247,
-    "C4": 262,
-    "C#4": 277,  # or "Db4": 277
-    "D4": 294,
-    "D#4": 311,  # or "Eb4": 311
-    "E4": 330,
-    "F4": 349,
-    "F#4": 370,  # or "Gb4": 370
-    "G4": 392,
-    "G#4": 415,  # or "Ab4": 415
-    "A4": 440,
-    "A#4": 466,  # or "Bb4": 466
-    "B4": 494,
-    "C5": 523,
-    "C#5": 554,  # or "Db5": 554
-    "D5": 587,
-    "D#5": 622,  # or "Eb5": 622
-    "E5": 659,
-    "F5": 698,
-    "F#5": 740,  # or "Gb5": 740
-    "G5": 784,
-    "G#5": 831,  # or "Ab5": 831
-    "A5": 880,
-    "A#5": 932,  # or "Bb5": 932
-    "B5": 988,
-    "C6": 1047,
-    "C#6": 1109,  # or "Db6": 1109
-    "D6": 1175,
-    "D#6": 1245,  # or "Eb6": 1245
-    "E6": 1319,
-    "F6": 1397,
-    "F#6": 1480,  # or "Gb6": 1480
-    "G6": 1568,
-    "G#6": 1661,  # or "Ab6": 1661
-    "A6": 1760,
-    "A#6": 1865,  # or "Bb6": 1865
-    "B6": 1976,
-    "C7": 2093,
-    "C#7": 2217,  # or "Db7": 2217
-    "D7": 2349,
-    "D#7": 2489,  # or "Eb7": 2489
-    "E7": 2637,
-    "F7": 2794,
-    "F#7": 2960,  # or "Gb7": 2960
-    "G7": 3136,
-    "G#7": 3322,  # or "Ab7": 3322
-    "A7": 3520,
-    "A#7": 3729,  # or "Bb7": 3729
-    "B7": 3951,
-    "C8": 4186,
-    "C#8": 4435,  # or "Db8": 4435
-    "D8": 4699,
-    "D#8": 4978,  # or "Eb8": 4978
-}
+
+# pygame et scipy sont importés à la première utilisation : ils coûtent cher au démarrage
+# et ne servent ni au rendu hors ligne (pygame) ni aux instruments autres que le xylophone (scipy)
+
+# Gamme tempérée exacte (La4 = 440 Hz), indexée par numéro de note MIDI (Do4 = 60)
+MIDI_FREQUENCIES = 440.0 * 2.0 ** ((np.arange(128) - 69) / 12)
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+LETTERS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+SOLFEGE = {'Do': 0, 'Ré': 2, 'Re': 2, 'Mi': 4, 'Fa': 5, 'Sol': 7, 'La': 9, 'Si': 11}
+DEFAULT_OCTAVE = 4
+NOTE_PATTERN = re.compile(r"^(Do|Ré|Re|Mi|Fa|Sol|La|Si|[A-G])([#b♯♭]*)(-?\d+)?$")
+_note_indices = {}
+
+
+def note_index(name):
+    # "C#4", "Db4", "Do#", "Ré4", "La#5"... -> numéro MIDI, ou None si la note est invalide.
+    # Sans octave, c'est l'octave 4 (comme les entrées solfège). Résultats gardés en cache.
+    index = _note_indices.get(name)
+    if index is not None:
+        return index
+    match = NOTE_PATTERN.match(name)
+    if match is None:
+        return None
+    step, accidentals, octave = match.groups()
+    pitch = LETTERS[step] if step in LETTERS else SOLFEGE[step]
+    pitch += accidentals.count('#') + accidentals.count('♯') - accidentals.count('b') - accidentals.count('♭')
+    index = 12 * ((int(octave) if octave else DEFAULT_OCTAVE) + 1) + pitch
+    if not 0 <= index < len(MIDI_FREQUENCIES):
+        return None
+    _note_indices[name] = index
+    return index
+
+
+def note_name(index):
+    # Nom canonique (dièses) d'un numéro MIDI : 61 -> "C#4"
+    return f"{PITCH_CLASSES[index % 12]}{index // 12 - 1}"
+
+
+def midi_frequency(index):
+    return float(MIDI_FREQUENCIES[index])
+
+
+# Table historique nom -> fréquence, désormais exacte : les entrées solfège donnent trois octaves
+# (4, 5, 6), les autres notes vont de B0 à D#8
+NOTE_RANGE = range(note_index("B0"), note_index("D#8") + 1)
+SOLFEGE_NAMES = ['Do', 'Do#', 'Ré', 'Ré#', 'Mi', 'Fa', 'Fa#', 'Sol', 'Sol#', 'La', 'La#', 'Si']
+note_to_frequency = {name: tuple(midi_frequency(12 * (octave + 1) + pitch) for octave in (4, 5, 6))
+                     for pitch, name in enumerate(SOLFEGE_NAMES)}
+note_to_frequency.update((note_name(index), midi_frequency(index)) for index in NOTE_RANGE)
     
     
 
 
+class ToneCache:
+    # Cache LRU des sons déjà synthétisés, borné en nombre d'entrées et en mémoire.
+    # Chaque entrée garde le buffer int16 stéréo et le pygame.Sound construit dessus.
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict  # appelé avec (buffer, sound) de chaque entrée évincée
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @staticmethod
+    def _entry_size(buffer, sound):
+        # pygame.Sound garde sa propre copie des échantillons
+        return buffer.nbytes if sound is None else 2 * buffer.nbytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def peek(self, key):
+        # Comme get, sans toucher aux compteurs ni à l'ordre LRU : pour relire une clé déjà comptée
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, buffer, sound):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= self._entry_size(*previous)
+            self._entries[key] = (buffer, sound)
+            self.nbytes += self._entry_size(buffer, sound)
+
+            # Evict the least recently used tones until we are back under both limits
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+                _, old_entry = self._entries.popitem(last=False)
+                self.nbytes -= self._entry_size(*old_entry)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(*old_entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class BufferPool:
+    # Réserve de tableaux NumPy réutilisables, rangés par forme et type : les buffers de travail
+    # et de sortie d'une note sont repris d'une note à l'autre au lieu d'être réalloués.
+    # Au plus `max_free` tableaux libres sont gardés par forme, et `max_bytes` au total : au-delà,
+    # les formes rendues le moins récemment (accords, morceaux mixés d'une longueur unique) sont libérées.
+
+    def __init__(self, max_free=8, max_bytes=16 * 1024 * 1024):
+        self.max_free = max_free
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.allocations = 0
+        self.reuses = 0
+        self.evictions = 0
+        self._free = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, shape, dtype=np.float64):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                self.reuses += 1
+                array = free.pop()
+                self.nbytes -= array.nbytes
+                return array
+            self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def give(self, array):
+        key = (array.shape, array.dtype.str)
+        if array.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            self._free.move_to_end(key)
+            if len(free) >= self.max_free:
+                return
+            free.append(array)
+            self.nbytes += array.nbytes
+            while self.nbytes > self.max_bytes:
+                oldest_key = next(iter(self._free))
+                oldest = self._free[oldest_key]
+                if oldest:
+                    self.nbytes -= oldest.pop(0).nbytes
+                    self.evictions += 1
+                if not oldest:
+                    del self._free[oldest_key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+                "free": sum(len(free) for free in self._free.values()),
+                "bytes": self.nbytes,
+                "evictions": self.evictions,
+            }
+
+
+_sample_indices = {}
+
+
+def sample_indices(num_samples):
+    # 0, 1, ..., num_samples - 1 en float64, partagé (lecture seule) entre les rendus
+    indices = _sample_indices.get(num_samples)
+    if indices is None:
+        indices = np.arange(num_samples, dtype=np.float64)
+        indices.flags.writeable = False
+        _sample_indices[num_samples] = indices
+    return indices
+
+
+class Wavetable:
+    # Table d'onde d'une période contenant déjà la somme pondérée de toutes les harmoniques.
+    # Le rendu lit la table avec un accumulateur de phase : un seul passage par note,
+    # quel que soit le nombre d'harmoniques, et plusieurs notes en un seul appel.
+
+    def __init__(self, harmonics, weights, size=4096):
+        self.size = size
+        # +1 point de garde pour l'interpolation linéaire en fin de période
+        phase = np.arange(size + 1) / size
+        partials = np.sin(2 * np.pi * np.outer(harmonics, phase))  # harmoniques x échantillons
+        self.table = np.asarray(weights, dtype=np.float64) @ partials
+
+    def render(self, frequencies, num_samples, sample_rate, out=None, pool=None):
+        # Écrit dans `out` s'il est fourni ; les tableaux intermédiaires viennent de `pool`
+        # et y retournent, si bien qu'un rendu répété n'alloue plus rien
+        frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+        shape = (len(frequencies), num_samples)
+        pool = pool if pool is not None else BufferPool(0)
+        tone = out if out is not None else np.empty(shape)
+        phase = pool.take(shape)
+        index = pool.take(shape, np.intp)
+        upper = pool.take(shape)
+
+        # Phase de chaque note, exprimée en position dans la table
+        np.multiply.outer(frequencies * (self.size / sample_rate), sample_indices(num_samples), out=phase)
+        np.mod(phase, self.size, out=phase)
+        np.copyto(index, phase, casting='unsafe')
+        phase -= index  # partie fractionnaire
+        np.take(self.table, index, out=tone)
+        index += 1
+        np.take(self.table, index, out=upper)
+        upper -= tone
+        upper *= phase
+        tone += upper
+
+        pool.give(phase)
+        pool.give(index)
+        pool.give(upper)
+        return tone
+
+
+PIANO_WAVETABLE = Wavetable(
+    [1, 2, 3, 4, 5, 6, 7, 8],
+    [0.5, 0.25, 0.1, 0.05, 0.025, 0.0125, 0.00625, 0.003125]
+)
+# Génération des harmoniques complexes pour un son métallique
+XYLOPHONE_WAVETABLE = Wavetable(
+    [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12],
+    [0.5, 0.4, 0.35, 0.3, 0.25, 0.2, 0.15, 0.1, 0.05, 0.03, 0.02, 0.01]
+)
+
+
+class DelayLineBank:
+    # Cordes pincées (Karplus-Strong) : chaque corde est une ligne à retard remplie de bruit, rebouclée
+    # sur un filtre moyenneur amorti, y[n] = decay * (y[n-L] + y[n-L-1]) / 2.
+    # Toutes les cordes avancent ensemble par blocs de la longueur de la plus courte ligne : un bloc ne
+    # lit que des échantillons déjà calculés, il est donc calculé en une seule opération NumPy pour
+    # toutes les cordes, au lieu d'une boucle Python par échantillon.
+
+    def __init__(self, decay=0.996, seed=0):
+        self.decay = decay
+        self.seed = seed
+
+    def delays(self, frequencies, sample_rate):
+        # Le filtre moyenneur ajoute un demi-échantillon de retard à la boucle
+        return np.maximum(np.rint(sample_rate / frequencies - 0.5).astype(np.intp), 2)
+
+    def render(self, frequencies, num_samples, sample_rate, out=None, pool=None):
+        frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+        pool = pool if pool is not None else BufferPool(0)
+        strings = len(frequencies)
+        delays = self.delays(frequencies, sample_rate)
+        history = int(delays.max()) + 1
+        width = history + num_samples
+        block = int(delays.min())
+
+        # Une ligne par corde : l'historique (le bruit de l'attaque) puis le son rendu. Même graine à
+        # chaque rendu : une note donne toujours le même son (cache, banque).
+        lines = pool.take((strings, width))
+        lines[:, :history] = np.random.default_rng(self.seed).uniform(-1, 1, (strings, history))
+        for line, delay in zip(lines, delays.tolist()):
+            # Bruit centré : la boucle conserve la composante continue, qui ne s'éteindrait jamais
+            excitation = line[history - delay - 1:history]
+            excitation -= excitation.mean()
+
+        # Positions (dans le tableau aplati) lues par le premier bloc, décalées ensuite de bloc en bloc
+        flat = lines.reshape(-1)
+        base = (np.arange(strings) * width - delays)[:, None] + sample_indices(block).astype(np.intp)
+        index = pool.take((strings, block), np.intp)
+        current = pool.take((strings, block))
+        previous = pool.take((strings, block))
+        gain = 0.5 * self.decay
+        for start in range(history, width, block):
+            size = min(block, width - start)
+            np.add(base[:, :size], start, out=index[:, :size])
+            np.take(flat, index[:, :size], out=current[:, :size])
+            index[:, :size] -= 1
+            np.take(flat, index[:, :size], out=previous[:, :size])
+            current[:, :size] += previous[:, :size]
+            current[:, :size] *= gain
+            lines[:, start:start + size] = current[:, :size]
+
+        tones = out if out is not None else np.empty((strings, num_samples))
+        tones[...] = lines[:, history:]
+        pool.give(lines)
+        pool.give(index)
+        pool.give(current)
+        pool.give(previous)
+        return tones
+
+
+GUITAR_STRINGS = DelayLineBank()
+STRUM_SPREAD = 0.012  # secondes entre deux cordes d'un accord gratté
+
+
+def _peak(tones):
+    # Amplitude crête de chaque note (ligne), sans tableau temporaire de la taille du son
+    peak = np.maximum(tones.max(axis=-1, keepdims=True), -tones.min(axis=-1, keepdims=True))
+    peak[peak == 0] = 1
+    return peak
+
+
+def _normalize(tones):
+    # Normalise chaque note (ligne) indépendamment, en place
+    tones /= _peak(tones)
+    return tones
+
+
+INSTRUMENTS = ("piano", "xylophone", "video_game", "guitar")
+
+
+def note_frequency(note):
+    # Fréquence exacte d'un nom de note (solfège sans octave : octave 4), None si inconnue
+    index = note_index(note)
+    return midi_frequency(index) if index is not None else None
+
+
+def bank_frequencies():
+    # Fréquences de toutes les notes de note_to_frequency (B0 à D#8, solfège compris)
+    return [midi_frequency(index) for index in NOTE_RANGE]
+
+
+class ResonatorBank:
+    # Filtres de résonance du xylophone pré-calculés : coefficients (b, a) et état initial zi
+    # pour chaque note, au lieu d'appeler bilinear / lfilter_zi à chaque frappe.
+    # Les fréquences hors de la table sont calculées une fois puis gardées.
+
+    def __init__(self, sample_rate, frequencies=None):
+        self.sample_rate = sample_rate
+        self.frequencies = list(frequencies) if frequencies is not None else bank_frequencies()
+        self.index = {frequency: i for i, frequency in enumerate(self.frequencies)}
+        self.b, self.a, self.zi = self.design(self.frequencies)
+        self._extra = {}
+
+    def design(self, frequencies):
+        # Équivalent vectorisé de bilinear([1, 0, 0], [1, -2 * 0.95 * cos(w), 0.9025], fs) puis
+        # lfilter_zi(b, a), pour toutes les fréquences d'un coup (une ligne par fréquence)
+        frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+        c1 = -2 * 0.95 * np.cos(2 * np.pi * frequencies / self.sample_rate)
+        c2 = 0.9025
+        k = 2.0 * self.sample_rate  # s = k (z - 1) / (z + 1)
+
+        den = np.empty((len(frequencies), 3))
+        den[:, 0] = k * k + c1 * k + c2
+        den[:, 1] = -2 * k * k + 2 * c2
+        den[:, 2] = k * k - c1 * k + c2
+        b = np.empty_like(den)
+        b[:] = [k * k, -2 * k * k, k * k]
+        b /= den[:, :1]
+        a = den / den[:, :1]
+
+        # État initial en régime permanent d'un filtre d'ordre 2 (solution de lfilter_zi)
+        rhs = b[:, 1:] - a[:, 1:] * b[:, :1]
+        zi = np.empty((len(frequencies), 2))
+        zi[:, 0] = (rhs[:, 0] + rhs[:, 1]) / (1 + a[:, 1] + a[:, 2])
+        zi[:, 1] = rhs[:, 1] - a[:, 2] * zi[:, 0]
+        return b, a, zi
+
+    def coefficients(self, frequency):
+        i = self.index.get(frequency)
+        if i is not None:
+            return self.b[i], self.a[i], self.zi[i]
+        coefficients = self._extra.get(frequency)
+        if coefficients is None:
+            b, a, zi = self.design([frequency])
+            coefficients = self._extra[frequency] = (b[0], a[0], zi[0])
+        return coefficients
+
+    def filter(self, frequencies, tones):
+        # Filtre toutes les notes (une ligne de `tones` par fréquence) : les lignes qui partagent
+        # une fréquence passent ensemble dans un seul lfilter 2D
+        from scipy.signal import lfilter
+
+        rows = {}
+        for row, frequency in enumerate(np.atleast_1d(frequencies).tolist()):
+            rows.setdefault(frequency, []).append(row)
+
+        for frequency, group in rows.items():
+            b, a, zi = self.coefficients(frequency)
+            block = tones[group]
+            block, _ = lfilter(b, a, block, axis=-1, zi=zi[np.newaxis, :] * block[:, :1])
+            tones[group] = block
+        return tones
+
+
+def user_cache_dir(*parts):
+    # Cache de l'utilisateur, même dossier que QStandardPaths.GenericCacheLocation mais sans Qt
+    # (rendu hors ligne, outils en ligne de commande)
+    if sys.platform == "win32":
+        base = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~"), "cache")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, *parts)
+
+
+class MemmapBank:
+    # Dossier de banques int16 : un en-tête JSON décrit les réglages du rendu, chaque banque est un
+    # .npy relu en memory-map tant que l'en-tête correspond. Sans dossier, tout reste en mémoire.
+
+    def __init__(self, directory, header_name, header):
+        self.directory = directory
+        self.header_name = header_name
+        self.header = header
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.npy") if self.directory else None
+
+    def header_matches(self):
+        if not self.directory:
+            return False
+        try:
+            with open(os.path.join(self.directory, self.header_name), 'r') as f:
+                return json.load(f) == self.header
+        except (OSError, ValueError):
+            return False
+
+    def write_header(self):
+        if self.directory:
+            with open(os.path.join(self.directory, self.header_name), 'w') as f:
+                json.dump(self.header, f)
+
+    def open(self, name):
+        # Banque déjà sur disque, en memory-map ; None si absente ou illisible
+        path = self.path(name)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def create(self, name, shape, fill):
+        # fill(bank) remplit le tableau int16 ; sur disque il est écrit dans un fichier temporaire
+        # puis renommé, pour ne jamais laisser une banque à moitié écrite
+        path = self.path(name)
+        if path is None:
+            bank = np.empty(shape, dtype=np.int16)
+            fill(bank)
+            return bank
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = path + ".tmp.npy"
+        bank = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int16, shape=shape)
+        fill(bank)
+        bank.flush()
+        del bank
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+
+
+class SampleBank:
+    # Banque de sons pré-calculés : une ligne int16 stéréo par fréquence et par instrument.
+    # Avec un dossier, chaque instrument est sauvé dans un .npy puis relu en memory-map
+    # aux lancements suivants, sans rien recalculer.
+
+    def __init__(self, player, directory=None, duration=1.0):
+        self.player = player
+        self.directory = directory
+        self.duration = duration
+        self.chunk = 16
+        self.frequencies = bank_frequencies()
+        self.index = {freq: i for i, freq in enumerate(self.frequencies)}
+        self.banks = {}
+        self.ready = threading.Event()
+        self.store = MemmapBank(directory, "bank.json", {
+            "sample_rate": player.sample_rate,
+            "duration": duration,
+            "frequencies": self.frequencies,
+        })
+
+    def load(self):
+        reuse = self.store.header_matches()
+        for instrument in INSTRUMENTS:
+            bank = self.store.open(instrument) if reuse else None
+            if bank is None:
+                bank = self.render(instrument)
+            self.banks[instrument] = bank
+        self.store.write_header()
+        self.ready.set()
+
+    def render(self, instrument):
+        shape = (len(self.frequencies), int(self.player.sample_rate * self.duration), 2)
+        return self.store.create(instrument, shape, lambda bank: self._fill(instrument, bank))
+
+    def _fill(self, instrument, bank):
+        # Rendu par paquets de notes pour borner la mémoire temporaire
+        for start in range(0, len(self.frequencies), self.chunk):
+            freqs = self.frequencies[start:start + self.chunk]
+            tones = self.player.render_tones(instrument, freqs, self.duration)
+            rows = bank[start:start + len(freqs)]
+            np.multiply(tones, 32767, out=rows[:, :, 0], casting='unsafe')
+            rows[:, :, 1] = rows[:, :, 0]
+
+    def provides(self, instrument, frequency, duration):
+        # Vrai si la banque contient (ou contiendra, une fois chargée) cette note
+        return instrument in INSTRUMENTS and duration == self.duration and frequency in self.index
+
+    def get(self, instrument, frequency, duration):
+        bank = self.banks.get(instrument)
+        if bank is None or duration != self.duration:
+            return None
+        i = self.index.get(frequency)
+        if i is None:
+            return None
+        return bank[i]
+
+
+class LatencyMonitor:
+    # Chronométrage de chaque note, de l'événement clavier jusqu'à la sortie son.
+    # begin() ouvre une mesure, chaque mark(étape) enregistre le temps écoulé depuis l'étape
+    # précédente, end() enregistre le total. Les dernières mesures de chaque étape sont gardées
+    # pour calculer p50/p95/p99.
+
+    def __init__(self, history=2000):
+        self.history = history
+        self.samples = {}
+        self._start = None
+        self._last = None
+
+    def begin(self):
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        if self._start is None:
+            return
+        now = time.perf_counter()
+        self.record(stage, now - self._last)
+        self._last = now
+
+    def end(self):
+        if self._start is None:
+            return
+        self.record("total", time.perf_counter() - self._start)
+        self._start = self._last = None
+
+    def record(self, stage, seconds):
+        # Mesure isolée (par ex. le délai d'une synthèse asynchrone), en secondes
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples[stage] = deque(maxlen=self.history)
+        samples.append(seconds * 1000)
+
+    def histogram(self, stage, bins=20):
+        counts, edges = np.histogram(np.fromiter(self.samples.get(stage, ()), dtype=np.float64), bins=bins)
+        return counts.tolist(), edges.tolist()
+
+    def summary(self):
+        # Statistiques par étape, en millisecondes
+        summary = {}
+        for stage, samples in self.samples.items():
+            values = np.fromiter(samples, dtype=np.float64, count=len(samples))
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[stage] = {
+                "count": len(values),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(values.max()),
+            }
+        return summary
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+
+
+class EnvelopeGenerator:
+    # ADSR calculée bloc par bloc pour les notes tenues : attaque -> déclin -> maintien tant que la
+    # touche est enfoncée -> relâchement dès note_off() -> fin. Chaque bloc coûte le même prix,
+    # quelle que soit la durée pendant laquelle la note est tenue. Durées en secondes.
+    ATTACK, DECAY, SUSTAIN, RELEASE, DONE = range(5)
+
+    def __init__(self, sample_rate, attack=0.01, decay=0.1, sustain_level=0.3, release=0.1):
+        self.lengths = {
+            self.ATTACK: int(sample_rate * attack),
+            self.DECAY: int(sample_rate * decay),
+            self.RELEASE: int(sample_rate * release),
+        }
+        self.sustain_level = sustain_level
+        self.stage = self.ATTACK
+        self.level = 0.0
+        self._start_level = 0.0
+        self._position = 0
+
+    @property
+    def done(self):
+        return self.stage == self.DONE
+
+    def note_off(self):
+        if self.stage < self.RELEASE:
+            self._enter(self.RELEASE)
+
+    def _enter(self, stage):
+        self.stage = stage
+        self._start_level = self.level
+        self._position = 0
+
+    def _target(self):
+        return {self.ATTACK: 1.0, self.DECAY: self.sustain_level, self.RELEASE: 0.0}[self.stage]
+
+    def process(self, out):
+        # Remplit `out` (un bloc) avec les valeurs de l'enveloppe, segment par segment, sans allocation
+        i = 0
+        n = len(out)
+        while i < n:
+            if self.stage == self.SUSTAIN:
+                out[i:] = self.level = self.sustain_level
+                return out
+            if self.stage == self.DONE:
+                out[i:] = self.level = 0.0
+                return out
+            length = self.lengths[self.stage]
+            if self._position >= length:
+                self.level = self._target()
+                self._enter(self.stage + 1)
+                continue
+            k = min(length - self._position, n - i)
+            slope = (self._target() - self._start_level) / length
+            segment = out[i:i + k]
+            np.multiply(sample_indices(k), slope, out=segment)
+            segment += self._start_level + slope * self._position
+            self._position += k
+            self.level = self._start_level + slope * self._position
+            i += k
+        return out
+
+
+class WavetableOscillator:
+    # Lecture continue d'une Wavetable, bloc après bloc (la phase est conservée entre les blocs)
+
+    def __init__(self, wavetable, frequency, sample_rate):
+        self.table = wavetable.table
+        self.size = wavetable.size
+        self.step = frequency * wavetable.size / sample_rate
+        self.gain = 1.0 / np.max(np.abs(wavetable.table))
+        self.phase = 0.0
+        self._index = None
+
+    def render(self, out):
+        n = len(out)
+        if self._index is None:
+            self._index = np.empty(n, dtype=np.intp)
+            self._fraction = np.empty(n)
+            self._upper = np.empty(n)
+        index, fraction, upper = self._index[:n], self._fraction[:n], self._upper[:n]
+        np.multiply(sample_indices(n), self.step, out=fraction)
+        fraction += self.phase
+        np.mod(fraction, self.size, out=fraction)
+        np.copyto(index, fraction, casting='unsafe')
+        fraction -= index
+        np.take(self.table, index, out=out)
+        index += 1
+        np.take(self.table, index, out=upper)
+        upper -= out
+        upper *= fraction
+        out += upper
+        out *= self.gain
+        self.phase = (self.phase + self.step * n) % self.size
+        return out
+
+
+class SquareOscillator:
+    # Onde carrée du mode jeu vidéo, bloc après bloc
+
+    def __init__(self, frequency, sample_rate):
+        self.step = 2 * np.pi * frequency / sample_rate
+        self.phase = 0.0
+
+    def render(self, out):
+        n = len(out)
+        np.multiply(sample_indices(n), self.step, out=out)
+        out += self.phase
+        np.sin(out, out=out)
+        np.sign(out, out=out)
+        self.phase = (self.phase + self.step * n) % (2 * np.pi)
+        return out
+
+
+class LiveVoice:
+    # Note tenue : oscillateur x enveloppe, rendus à la demande par le mixeur streaming
+
+    def __init__(self, oscillator, envelope):
+        self.oscillator = oscillator
+        self.envelope = envelope
+        self._envelope_block = None
+
+    @property
+    def done(self):
+        return self.envelope.done
+
+    def note_off(self):
+        self.envelope.note_off()
+
+    def render(self, out):
+        if self._envelope_block is None or len(self._envelope_block) != len(out):
+            self._envelope_block = np.empty(len(out))
+        self.oscillator.render(out)
+        out *= self.envelope.process(self._envelope_block)
+        return out
+
+
+# Instruments jouables en notes tenues (le xylophone, percussif, reste une note jouée d'un coup)
+LIVE_INSTRUMENTS = {
+    "piano": dict(attack=0.01, decay=0.1, sustain_level=0.3, release=0.1),
+    "video_game": dict(attack=0.005, decay=0.0, sustain_level=1.0, release=0.02),
+}
+
+
+class StreamingMixer:
+    # Mixeur temps réel : une seule sortie (un canal pygame réservé) alimentée par un thread
+    # audio qui mixe toutes les voix actives par blocs de taille fixe.
+    # Les voix référencent directement les buffers int16 du cache, sans créer de Sound par note,
+    # et quand toutes les voix sont prises la plus ancienne est volée.
+    # Une voix peut aussi être une LiveVoice (note tenue), rendue bloc par bloc jusqu'à sa fin.
+
+    def __init__(self, sample_rate=44100, block_size=256, max_voices=32, volume=0.05, ring_size=4):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.max_voices = max_voices
+        self.volume = volume
+        self.ring_size = ring_size
+        self.stolen = 0
+        self.underruns = 0
+
+        # Table des voix : buffer joué (ou LiveVoice), position de lecture et ordre de démarrage
+        self._buffers = [None] * max_voices
+        self._positions = [0] * max_voices
+        self._started = [0] * max_voices
+        self._serial = 0
+        # Boucle (mesure de boîte à rythmes) : hors de la table des voix, jamais volée
+        self._loop = None
+        self._loop_position = 0
+
+        self._mix = np.zeros((block_size, 2), dtype=np.float32)
+        self._voice_block = np.zeros(block_size)
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+        import pygame
+
+        pygame.mixer.set_reserved(1)
+        self.channel = pygame.mixer.Channel(0)
+        # Anneau de blocs de sortie : on écrit directement dans les échantillons de chaque Sound
+        silence = np.zeros((self.block_size, 2), dtype=np.int16)
+        self._blocks = [pygame.sndarray.make_sound(silence) for _ in range(self.ring_size)]
+        self._views = [pygame.sndarray.samples(block) for block in self._blocks]
+        self._next_block = 0
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="streaming-mixer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.channel.stop()
+
+    def play(self, buffer):
+        self._start_voice(buffer)
+
+    def note_on(self, voice):
+        self._start_voice(voice)
+
+    def note_off(self, voice):
+        with self._lock:
+            voice.note_off()
+
+    def loop(self, buffer):
+        # Remplacer la boucle en cours garde la position de lecture ; None l'arrête
+        with self._lock:
+            if buffer is None or self._loop is None:
+                self._loop_position = 0
+            else:
+                self._loop_position %= len(buffer)
+            self._loop = buffer
+
+    def _start_voice(self, buffer):
+        with self._lock:
+            slot = None
+            for i, current in enumerate(self._buffers):
+                if current is None:
+                    slot = i
+                    break
+            if slot is None:
+                # Polyphonie pleine : on vole la voix la plus ancienne
+                slot = min(range(self.max_voices), key=self._started.__getitem__)
+                self.stolen += 1
+            self._serial += 1
+            self._buffers[slot] = buffer
+            self._positions[slot] = 0
+            self._started[slot] = self._serial
+
+    def active_voices(self):
+        return sum(buffer is not None for buffer in self._buffers)
+
+    def mix_block(self, out):
+        mix = self._mix
+        mix.fill(0)
+        with self._lock:
+            for i, buffer in enumerate(self._buffers):
+                if buffer is None:
+                    continue
+                if isinstance(buffer, LiveVoice):
+                    voice_block = buffer.render(self._voice_block)
+                    voice_block *= 32767
+                    mix += voice_block[:, np.newaxis]
+                    if buffer.done:
+                        self._buffers[i] = None
+                    continue
+                position = self._positions[i]
+                n = min(self.block_size, len(buffer) - position)
+                np.add(mix[:n], buffer[position:position + n], out=mix[:n])
+                position += n
+                if position >= len(buffer):
+                    self._buffers[i] = None
+                self._positions[i] = position
+
+            loop = self._loop
+            if loop is not None:
+                filled = 0
+                position = self._loop_position
+                while filled < self.block_size:
+                    n = min(self.block_size - filled, len(loop) - position)
+                    np.add(mix[filled:filled + n], loop[position:position + n], out=mix[filled:filled + n])
+                    filled += n
+                    position = (position + n) % len(loop)
+                self._loop_position = position
+
+        mix *= self.volume
+        np.clip(mix, -32768, 32767, out=mix)
+        np.copyto(out, mix, casting='unsafe')
+
+    def _run(self):
+        block_seconds = self.block_size / self.sample_rate
+        while self._running:
+            # pygame garde un bloc en cours de lecture et un seul bloc en attente
+            if self.channel.get_busy() and self.channel.get_queue() is not None:
+                time.sleep(block_seconds / 4)
+                continue
+
+            block = self._blocks[self._next_block]
+            self.mix_block(self._views[self._next_block])
+            self._next_block = (self._next_block + 1) % self.ring_size
+            if self.channel.get_busy():
+                self.channel.queue(block)
+            else:
+                self.underruns += 1
+                self.channel.play(block)
+
+
 class MusicPlayer:
     
-    def __init__(self, sample_rate=44100): 
-        pygame.mixer.init(frequency=44100, size=-16, channels=2)
+    def __init__(self, sample_rate=44100, cache_entries=256, cache_bytes=64 * 1024 * 1024, warm_up=False, bank_dir=None,
+                 streaming=False, block_size=256, max_voices=32, audio=True, lazy=False): 
+        # audio=False : synthèse seule, sans ouvrir la sortie son (rendu hors ligne)
+        # lazy=True : pygame n'est importé et la sortie son ouverte qu'au premier son
+        # (ou plus tôt, en tâche de fond, avec init_audio_async)
         self.sample_rate = sample_rate
+        self.volume = 0.05
+        self.audio = audio
+        self.streaming = streaming and audio
+        self.block_size = block_size
+        self.max_voices = max_voices
+        # Buffers réutilisables (synthèse et sortie int16) ; les sons évincés du cache y retournent
+        self.buffers = BufferPool()
+        self.tone_cache = ToneCache(cache_entries, cache_bytes, on_evict=self._recycle)
+        self._curves = {}
+        self.latency = LatencyMonitor()
+        self.resonators = ResonatorBank(sample_rate)
+        self.sample_bank = None
+        if warm_up:
+            self.warm_up(bank_dir)
+        self.mixer = None
+        # synthesis : callable(instrument, fréquence, durée) appelé à la place de la synthèse
+        # quand une note n'est pas en cache (service asynchrone de l'interface)
+        self.synthesis = None
+        # Boucle jouée sans mixeur streaming : (buffer, instant de départ, position de départ)
+        self._loop = None
+        self._audio_ready = False
+        self._audio_lock = threading.Lock()
+        if audio and not lazy:
+            self.init_audio()
+
+    def init_audio(self):
+        if self._audio_ready or not self.audio:
+            return
+        with self._audio_lock:
+            if self._audio_ready:
+                return
+            import pygame
+
+            if self.streaming:
+                # Le tampon SDL doit avoir la taille d'un bloc, sinon le canal consomme plusieurs blocs d'un coup
+                pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=self.block_size)
+                self.mixer = StreamingMixer(self.sample_rate, self.block_size, self.max_voices, self.volume)
+                self.mixer.start()
+            else:
+                pygame.mixer.init(frequency=44100, size=-16, channels=2)
+                # Canal 0 réservé aux boucles (play_loop)
+                pygame.mixer.set_reserved(1)
+            self._audio_ready = True
+
+    def init_audio_async(self):
+        worker = threading.Thread(target=self.init_audio, name="audio-init", daemon=True)
+        worker.start()
+        return worker
+
+    def close(self):
+        self.stop_loop()
+        if self.mixer is not None:
+            self.mixer.stop()
+            self.mixer = None
+            # Les entrées du cache créées en streaming n'ont pas de Sound
+            self.tone_cache.clear()
+
+    def warm_up(self, bank_dir=None):
+        # Pré-calcule toutes les notes de tous les instruments sur un thread de fond
+        self.sample_bank = SampleBank(self, bank_dir)
+        worker = threading.Thread(target=self.sample_bank.load, name="sample-bank", daemon=True)
+        worker.start()
+        return worker
+
+    def prefetch(self, instrument, frequencies, duration):
+        # Prépare en tâche de fond les sons de ces notes dans le cache (banque ou synthèse groupée),
+        # pour que leur première lecture ne coûte pas de synthèse
+        worker = threading.Thread(target=self._prefetch, args=(instrument, frequencies, duration),
+                                  name="prefetch", daemon=True)
+        worker.start()
+        return worker
+
+    def _prefetch(self, instrument, frequencies, duration):
+        # N'ouvre pas la sortie son : seuls les buffers sont préparés, les Sound viendront à la lecture
+        missing = []
+        for frequency in frequencies:
+            key = (instrument, frequency, duration)
+            if not frequency or key in self.tone_cache:
+                continue
+            # Notes fournies par la banque (même encore en chargement) : rien à synthétiser ici
+            if self.sample_bank is not None and self.sample_bank.provides(instrument, frequency, duration):
+                continue
+            missing.append(frequency)
+        if missing:
+            tones = self.render_tones(instrument, missing, duration)
+            for frequency, tone in zip(missing, tones):
+                buffer = self._to_stereo_int16(tone, self.buffers.take((len(tone), 2), np.int16))
+                self._cache_buffer((instrument, frequency, duration), buffer)
+
+    def _cache_buffer(self, key, buffer):
+        # Sortie son pas encore ouverte (préchargement) : le Sound sera créé à la première lecture
+        sound = self._make_sound(buffer) if self._audio_ready and self.mixer is None else None
+        self.tone_cache.put(key, buffer, sound)
+
+    def _with_sound(self, key, entry):
+        buffer, sound = entry
+        if sound is None and self.mixer is None and self._audio_ready:
+            sound = self._make_sound(buffer)
+            self.tone_cache.put(key, buffer, sound)
+        return buffer, sound
+
+    def _recycle(self, buffer, sound):
+        # Un son évincé qui a son pygame.Sound (copie propre) libère son buffer pour les notes suivantes.
+        # Jamais les lignes de la banque (memmap) ni les buffers que le mixeur streaming peut encore lire.
+        if sound is not None and buffer.flags.owndata and buffer.flags.writeable:
+            self.buffers.give(buffer)
+
+    def curve(self, name, num_samples, factory):
+        # Courbes (enveloppes, axes de temps) calculées une fois par longueur puis partagées
+        key = (name, num_samples)
+        curve = self._curves.get(key)
+        if curve is None:
+            curve = factory()
+            curve.flags.writeable = False
+            self._curves[key] = curve
+        return curve
+
+    def renderer(self, instrument):
+        return {
+            "piano": self.render_piano_tone,
+            "xylophone": self.render_xylophone_tone,
+            "video_game": self.render_videoGame_tone,
+            "guitar": self.render_guitar_tone,
+            "guitar_strum": self.render_strum,
+        }[instrument]
+
+    def render_tones(self, instrument, frequencies, duration, out=None):
+        # Rend plusieurs notes d'un coup, une ligne par fréquence
+        return {
+            "piano": self.render_piano_tones,
+            "xylophone": self.render_xylophone_tones,
+            "video_game": self.render_videoGame_tones,
+            "guitar": self.render_guitar_tones,
+        }[instrument](frequencies, duration, out=out)
+
+    def note_on(self, instrument, frequency):
+        # Démarre une note tenue, jouée par le mixeur streaming jusqu'à note_off(). Rend None quand
+        # ce n'est pas possible (pas de mixeur streaming, instrument percussif) : l'appelant joue
+        # alors la note d'un coup, comme avant.
+        if self.mixer is None or instrument not in LIVE_INSTRUMENTS or not frequency:
+            return None
+        voice = LiveVoice(self.oscillator(instrument, frequency),
+                          EnvelopeGenerator(self.sample_rate, **LIVE_INSTRUMENTS[instrument]))
+        self.mixer.note_on(voice)
+        return voice
+
+    def note_off(self, voice):
+        if self.mixer is not None:
+            self.mixer.note_off(voice)
+        else:
+            voice.note_off()
+
+    def oscillator(self, instrument, frequency):
+        if instrument == "video_game":
+            return SquareOscillator(frequency, self.sample_rate)
+        return WavetableOscillator(PIANO_WAVETABLE, frequency, self.sample_rate)
+
+    def mix_entry(self, mix):
+        # (buffer, Sound) d'un morceau déjà mixé (mono float), normalisé comme une note seule.
+        # Normalisation et conversion int16 en une passe, sans copie float ; à appeler depuis le
+        # thread de rendu, l'interface n'a plus qu'à faire play_entry(). Longueur unique : pas de
+        # buffer de la réserve, il ne resservirait jamais.
+        buffer = self._to_stereo_int16(mix, gain=32767 / _peak(mix).item() if len(mix) else 0)
+        self.init_audio()
+        sound = self._make_sound(buffer) if self._audio_ready and self.mixer is None else None
+        return buffer, sound
+
+    def play_sample(self, key, buffer):
+        # Joue un son int16 stéréo déjà prêt (ligne d'une banque memory-map) ; le Sound est gardé
+        # en cache sous `key`, un déclenchement suivant ne fait que le rejouer
+        entry = self.tone_cache.get(key)
+        self.init_audio()
+        if entry is None:
+            self._cache_buffer(key, buffer)
+            entry = self.tone_cache.peek(key)
+        self.play_entry(self._with_sound(key, entry))
+
+    def play_loop(self, buffer):
+        # Boucle un buffer int16 stéréo jusqu'à stop_loop(). Le remplacer pendant la lecture reprend
+        # à la même position dans la mesure : la modification s'entend sans repartir du début.
+        self.init_audio()
+        if self.mixer is not None:
+            self.mixer.loop(buffer)
+            return
+        if not self.audio:
+            return
+        import pygame
+
+        position = 0
+        if self._loop is not None:
+            _, started, start_position = self._loop
+            position = (start_position + int((time.perf_counter() - started) * self.sample_rate)) % len(buffer)
+        # pygame ne sait pas démarrer un son au milieu : on boucle la mesure décalée d'autant
+        looped = np.roll(buffer, -position, axis=0) if position else buffer
+        pygame.mixer.Channel(0).play(self._make_sound(looped), loops=-1)
+        self._loop = (buffer, time.perf_counter(), position)
+
+    def stop_loop(self):
+        if self.mixer is not None:
+            self.mixer.loop(None)
+        elif self._loop is not None:
+            import pygame
+
+            pygame.mixer.Channel(0).stop()
+        self._loop = None
+
+    def play_chord(self, instrument, frequencies, duration):
+        # Un accord est rendu en un seul passage puis joué comme un seul son
+        chord = self.render_tones(instrument, frequencies, duration).sum(axis=0)
+        self._play_tone(_normalize(chord), duration)
         
 
     def play_xylophone_tone(self, frequency, duration):
-        # Génération des harmoniques complexes pour un son métallique
-        harmonics = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
-        harmonics_weights = [0.5, 0.4, 0.35, 0.3, 0.25, 0.2, 0.15, 0.1, 0.05, 0.03, 0.02, 0.01]
+        self._play_cached("xylophone", frequency, duration, self.render_xylophone_tone)
 
-        # Generate the tone
-        t = np.linspace(0, duration, int(self.sample_rate * duration), False)
-        tone = sum(weight * np.sin(frequency * harmonic * 2 * np.pi * t) for harmonic, weight in zip(harmonics, harmonics_weights))
-        tone *= (0.5 * np.pi)
+    def render_xylophone_tone(self, frequency, duration, normalize=True, out=None):
+        return self.render_xylophone_tones([frequency], duration, normalize, out)[0]
+
+    def render_xylophone_tones(self, frequencies, duration, normalize=True, out=None):
+        # Generate the tones
+        num_samples = int(self.sample_rate * duration)
+        tones = XYLOPHONE_WAVETABLE.render(frequencies, num_samples, self.sample_rate, out, self.buffers)
 
         # Appliquer un filtre de résonance pour simuler la sonorité métallique
-        b, a = bilinear([1, 0, 0], [1, -2 * 0.95 * np.cos(2 * np.pi * frequency / self.sample_rate), 0.9025], fs=self.sample_rate)
-        zi = lfilter_zi(b, a)
-        tone, _ = lfilter(b, a, tone, zi=zi*tone[0])
+        self.resonators.filter(frequencies, tones)
 
-        # Apply a quick decay envelope
-        envelope = np.linspace(1, 0, len(tone))
-        tone *= envelope
+        # Apply a quick decay envelope. Le filtre étant linéaire, le gain (0.5 * pi) appliqué
+        # avant lui dans la version d'origine est intégré à cette courbe : une seule passe
+        tones *= self.curve("xylophone_decay", num_samples, lambda: 0.5 * np.pi * np.linspace(1, 0, num_samples))
 
         # Normalisation du ton
-        tone = tone / np.max(np.abs(tone))
-
-        # Jouer le son
-        self._play_tone(tone, duration)
+        return _normalize(tones) if normalize else tones
 
         
         
     def play_piano_tone(self, frequency, duration):
-        # Create harmonics
-        harmonics = [1, 2, 3, 4, 5, 6, 7, 8]
-        harmonics_weights = [0.5, 0.25, 0.1, 0.05, 0.025, 0.0125, 0.00625, 0.003125]
+        self._play_cached("piano", frequency, duration, self.render_piano_tone)
 
-        # Generate tone
-        t = np.linspace(0, duration, int(self.sample_rate * duration), False)
-        tone = sum(weight * np.sin(frequency * harmonic * 2 * np.pi * t) for harmonic, weight in zip(harmonics, harmonics_weights))
+    def render_piano_tone(self, frequency, duration, normalize=True, out=None):
+        return self.render_piano_tones([frequency], duration, normalize, out)[0]
 
-        # Ensure the envelope matches the length of the tone array
-        envelope = self.create_envelope(len(tone), attack_percent=0.01, decay_percent=0.1, sustain_level=0.3, release_percent=0.1)
+    def render_piano_tones(self, frequencies, duration, normalize=True, out=None):
+        # Generate tones, all harmonics at once through the wavetable
+        num_samples = int(self.sample_rate * duration)
+        tones = PIANO_WAVETABLE.render(frequencies, num_samples, self.sample_rate, out, self.buffers)
 
-        # Apply envelope to the tone
-        tone *= envelope
-        tone = tone / np.max(np.abs(tone))  # Normalization
+        # Ensure the envelope matches the length of the tone array (calculée une fois par longueur)
+        envelope = self.curve("piano_envelope", num_samples, lambda: self.create_envelope(
+            num_samples, attack_percent=0.01, decay_percent=0.1, sustain_level=0.3, release_percent=0.1))
 
-        # Play tone
-        self._play_tone(tone, duration)
+        # Apply envelope to the tones
+        tones *= envelope
+        return _normalize(tones) if normalize else tones
 
     def create_envelope(self, num_samples, attack_percent, decay_percent, sustain_level, release_percent):
         # Calculate lengths of each part of the ADSR envelope
@@ -186,17 +1168,144 @@ class MusicPlayer:
         return envelope[:num_samples]
 
     def play_videoGame_tone(self, frequency, duration):
-        t = np.linspace(0, duration, int(self.sample_rate * duration), False)
-        tone = np.sign(np.sin(frequency * 2 * np.pi * t))
-        self._play_tone(tone, duration)
+        self._play_cached("video_game", frequency, duration, self.render_videoGame_tone)
 
-    def _play_tone(self, tone, duration):
-        stereo_tone = np.vstack((tone, tone)).T
-        contiguous_tone = np.ascontiguousarray((32767 * stereo_tone).astype(np.int16))
-        sound = pygame.sndarray.make_sound(contiguous_tone)
-        sound.set_volume(0.05)  # Réglez le volume
-        sound.play()
+    def render_videoGame_tone(self, frequency, duration, normalize=True, out=None):
+        return self.render_videoGame_tones([frequency], duration, normalize, out)[0]
 
-        
-        
-    
\ No newline at end of file
+    def render_videoGame_tones(self, frequencies, duration, normalize=True, out=None):
+        # Onde carrée : déjà entre -1 et 1, la normalisation ne change rien
+        num_samples = int(self.sample_rate * duration)
+        t = self.curve(("time", duration), num_samples, lambda: np.linspace(0, duration, num_samples, False))
+        frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+        tones = out if out is not None else np.empty((len(frequencies), num_samples))
+        np.multiply.outer(frequencies * 2 * np.pi, t, out=tones)
+        np.sin(tones, out=tones)
+        return np.sign(tones, out=tones)
+
+    def play_guitar_tone(self, frequency, duration):
+        self._play_cached("guitar", frequency, duration, self.render_guitar_tone)
+
+    def render_guitar_tone(self, frequency, duration, normalize=True, out=None):
+        return self.render_guitar_tones([frequency], duration, normalize, out)[0]
+
+    def render_guitar_tones(self, frequencies, duration, normalize=True, out=None):
+        # Toutes les cordes en un seul passage du moteur à lignes à retard
+        num_samples = int(self.sample_rate * duration)
+        tones = GUITAR_STRINGS.render(frequencies, num_samples, self.sample_rate, out, self.buffers)
+        # Les cordes graves sonnent encore à la fin de la note : courte extinction pour éviter un clic
+        tones *= self.guitar_release(num_samples)
+        return _normalize(tones) if normalize else tones
+
+    def guitar_release(self, num_samples):
+        return self.curve("guitar_release", num_samples, lambda: np.minimum(
+            1.0, np.linspace(num_samples / max(int(num_samples * 0.05), 1), 0, num_samples)))
+
+    def play_strum(self, frequencies, duration):
+        # Un accord gratté est mis en cache (et rendu en arrière-plan) comme une note unique
+        self._play_cached("guitar_strum", tuple(frequencies), duration, self.render_strum)
+
+    def render_strum(self, frequencies, duration, normalize=True, out=None, spread=STRUM_SPREAD):
+        # Les cordes sont rendues ensemble puis mixées, chacune décalée de `spread` par rapport à la
+        # précédente (de la plus grave à la plus aiguë, comme un coup de médiator vers le bas)
+        num_samples = int(self.sample_rate * duration)
+        frequencies = sorted(frequencies)
+        tones = GUITAR_STRINGS.render(frequencies, num_samples, self.sample_rate,
+                                      self.buffers.take((len(frequencies), num_samples)), self.buffers)
+        mix = out if out is not None else np.empty((1, num_samples))
+        mix = mix.reshape(-1)
+        mix[:] = 0
+        offset = int(self.sample_rate * spread)
+        for i, tone in enumerate(tones):
+            start = min(i * offset, num_samples)
+            mix[start:] += tone[:num_samples - start]
+        self.buffers.give(tones)
+        mix *= self.guitar_release(num_samples)
+        return _normalize(mix) if normalize else mix
+
+    def _play_cached(self, instrument, frequency, duration, render):
+        # Les notes répétées réutilisent le son déjà synthétisé
+        key = (instrument, frequency, duration)
+        entry = self.tone_cache.get(key)
+        latency = self.latency
+        if entry is None and self.synthesis is not None:
+            # Rendu confié au service asynchrone, qui jouera la note une fois prête
+            self.synthesis(instrument, frequency, duration)
+            latency.mark("queued")
+            return
+        self.init_audio()
+        if entry is None:
+            entry = self._build_entry(key, render, latency.mark)
+        else:
+            entry = self._with_sound(key, entry)
+            latency.mark("cache")
+        self.play_entry(entry)
+        latency.mark("play")
+
+    def tone_entry(self, instrument, frequency, duration):
+        # (buffer, Sound) prêt à jouer, depuis le cache ou construit ; utilisable depuis un thread de fond.
+        # Appelé après un défaut déjà compté par _play_cached : peek ne le compte pas une seconde fois
+        key = (instrument, frequency, duration)
+        entry = self.tone_cache.peek(key)
+        self.init_audio()
+        if entry is None:
+            return self._build_entry(key, self.renderer(instrument))
+        return self._with_sound(key, entry)
+
+    def play_entry(self, entry):
+        buffer, sound = entry
+        if self.mixer is not None:
+            self.mixer.play(buffer)
+        else:
+            sound.play()
+
+    def _build_entry(self, key, render, mark=lambda stage: None):
+        instrument, frequency, duration = key
+        buffer = None
+        if self.sample_bank is not None:
+            buffer = self.sample_bank.get(instrument, frequency, duration)
+            mark("bank")
+        if buffer is None:
+            # Synthèse dans un buffer de travail réutilisé, puis conversion directe en int16
+            # stéréo entrelacé : la normalisation est appliquée comme gain pendant la conversion
+            num_samples = int(self.sample_rate * duration)
+            work = self.buffers.take((1, num_samples))
+            tone = render(frequency, duration, normalize=False, out=work)
+            mark("synthesis")
+            gain = 32767 / _peak(tone)[0]
+            mark("normalize")
+            buffer = self._to_stereo_int16(tone, self.buffers.take((num_samples, 2), np.int16), gain)
+            self.buffers.give(work)
+            mark("convert")
+        # En mode streaming le mixeur lit directement le buffer, pas besoin de Sound
+        sound = self._make_sound(buffer) if self.mixer is None else None
+        self.tone_cache.put(key, buffer, sound)
+        mark("sound")
+        return buffer, sound
+
+    def _to_stereo_int16(self, tone, out=None, gain=32767):
+        # Écrit le canal gauche directement en int16 (mise à l'échelle et conversion en une passe),
+        # puis le recopie à droite : aucun tableau intermédiaire
+        if out is None:
+            out = np.empty((len(tone), 2), dtype=np.int16)
+        np.multiply(tone, gain, out=out[:, 0], casting='unsafe')
+        out[:, 1] = out[:, 0]
+        return out
+
+    def _make_sound(self, buffer):
+        import pygame
+
+        sound = pygame.sndarray.make_sound(buffer)
+        sound.set_volume(self.volume)  # Réglez le volume
+        return sound
+
+    def _play_tone(self, tone, duration):
+        self.init_audio()
+        buffer = self._to_stereo_int16(tone, self.buffers.take((len(tone), 2), np.int16))
+        if self.mixer is not None:
+            # Le mixeur lit ce buffer pendant toute la note : il ne retourne pas dans la réserve
+            self.mixer.play(buffer)
+        else:
+            # pygame.Sound copie les échantillons : le buffer est libre aussitôt
+            self._make_sound(buffer).play()
+            self.buffers.give(buffer)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Import et export de fichiers MIDI standard (.mid).
+
+L'import lit le fichier bloc par bloc (une piste MTrk en mémoire à la fois) et écrit chaque note
+directement dans des tableaux typés (array) : aucun dictionnaire Python par événement. Les ticks sont
+convertis en temps par la carte des tempos, en une seule passe NumPy, puis le tout devient une
+partition compilée (score.CompiledScore) dont les événements sont
+(départ, numéro MIDI, durée) en échantillons, plus la vélocité et le canal.
+
+L'export écrit un enregistrement (.rec ou .json) en un seul passage : les note-off en attente sont
+gardés dans un tas et écrits au fil des note-on.
+
+    python midi.py song.mid                           # résumé du fichier
+    python midi.py recording_153012.rec -o take.mid   # enregistrement -> MIDI
+"""
+
+import os
+import heapq
+import struct
+import argparse
+from array import array
+
+import numpy as np
+
+from instrument import note_index, note_name
+from score import CompiledScore, FORMAT_VERSION
+from recording import load_recording
+
+MIDI_EVENT_DTYPE = np.dtype([('onset', '<i8'), ('note', '<i2'), ('duration', '<i4'),
+                             ('velocity', 'u1'), ('channel', 'u1')])
+HEADER = struct.Struct('>4sI')
+DEFAULT_TEMPO = 500000  # microsecondes par noire (120 bpm)
+DIVISION = 480  # ticks par noire à l'export
+VELOCITY = 100
+DRUM_CHANNEL = 9  # canal 10 General MIDI
+# Export : instrument -> (canal, programme General MIDI) ; percussions sans changement de programme
+INSTRUMENT_CHANNELS = {
+    "piano": (0, 0),
+    "xylophone": (1, 13),
+    "video_game": (2, 80),
+    "guitar": (3, 24),
+    "drums": (DRUM_CHANNEL, None),
+}
+
+
+def program_instrument(program):
+    # Famille General MIDI du programme -> instrument de l'application
+    if 8 <= program < 16:
+        return "xylophone"
+    if 24 <= program < 32:
+        return "guitar"
+    if 80 <= program < 88:
+        return "video_game"
+    return "piano"
+
+
+def read_chunks(f):
+    # (type, données) de chaque bloc ; seul le bloc courant est en mémoire
+    while True:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        kind, length = HEADER.unpack(header)
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError(f"Truncated {kind.decode('latin-1')} chunk")
+        yield kind, data
+
+
+def _vlq(value):
+    # Quantité de longueur variable MIDI (7 bits par octet, poids fort en premier)
+    if value < 0x80:
+        return bytes((value,))
+    out = bytearray((value & 0x7F,))
+    value >>= 7
+    while value:
+        out.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(out)
+
+
+def _varint(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+class NoteArrays:
+    # Notes lues, en tableaux parallèles typés (comme la frise) ; off = -1 tant que la note est tenue
+
+    def __init__(self):
+        self.on = array('q')
+        self.off = array('q')
+        self.note = array('B')
+        self.velocity = array('B')
+        self.channel = array('B')
+
+    def __len__(self):
+        return len(self.on)
+
+
+def parse_track(data, notes, tempos, programs):
+    # Analyse une piste MTrk : notes dans `notes`, changements de tempo (tick, µs/noire) dans `tempos`,
+    # dernier programme de chaque canal dans `programs`
+    held = [[] for _ in range(16 * 128)]  # (canal, note) -> indices des notes tenues, dans l'ordre
+    pos = 0
+    tick = 0
+    status = 0
+    end = len(data)
+    try:
+        while pos < end:
+            delta, pos = _varint(data, pos)
+            tick += delta
+            if data[pos] >= 0x80:
+                status = data[pos]
+                pos += 1
+            elif status == 0:
+                raise ValueError("Running status without a previous status byte")
+
+            if status == 0xFF:
+                meta = data[pos]
+                length, pos = _varint(data, pos + 1)
+                if meta == 0x51 and length == 3:
+                    tempos.append((tick, int.from_bytes(data[pos:pos + 3], 'big')))
+                pos += length
+                status = 0
+                if meta == 0x2F:
+                    break
+            elif status in (0xF0, 0xF7):
+                length, pos = _varint(data, pos)
+                pos += length
+                status = 0
+            elif status & 0xF0 in (0xC0, 0xD0):
+                if status & 0xF0 == 0xC0:
+                    programs[status & 0x0F] = data[pos]
+                pos += 1
+            else:
+                kind = status & 0xF0
+                key = ((status & 0x0F) << 7) | data[pos]
+                velocity = data[pos + 1]
+                pos += 2
+                if kind == 0x90 and velocity:
+                    held[key].append(len(notes))
+                    notes.on.append(tick)
+                    notes.off.append(-1)
+                    notes.note.append(key & 0x7F)
+                    notes.velocity.append(velocity)
+                    notes.channel.append(key >> 7)
+                elif kind in (0x80, 0x90) and held[key]:
+                    # Note-off (ou note-on de vélocité nulle) : ferme la plus ancienne note tenue
+                    notes.off[held[key].pop(0)] = tick
+    except IndexError:
+        raise ValueError("Truncated MIDI track") from None
+
+    # Notes jamais relâchées : elles durent jusqu'à la fin de la piste
+    for indices in held:
+        for i in indices:
+            notes.off[i] = tick
+
+
+class TempoMap:
+    # Conversion ticks -> secondes, vectorisée : segments de tempo constant
+
+    def __init__(self, tempos, division):
+        if division & 0x8000:
+            # Division SMPTE : images par seconde x ticks par image, sans tempo
+            fps = 256 - (division >> 8)
+            self.ticks = np.zeros(1, dtype=np.int64)
+            self.seconds = np.zeros(1)
+            self.seconds_per_tick = np.array([1.0 / (fps * (division & 0xFF))])
+            return
+        tempos = sorted(tempos, key=lambda change: change[0])
+        if not tempos or tempos[0][0] > 0:
+            tempos.insert(0, (0, DEFAULT_TEMPO))
+        self.ticks = np.array([tick for tick, _ in tempos], dtype=np.int64)
+        self.seconds_per_tick = np.array([tempo for _, tempo in tempos], dtype=np.float64) / (1e6 * division)
+        self.seconds = np.concatenate(([0.0], np.cumsum(np.diff(self.ticks) * self.seconds_per_tick[:-1])))
+
+    def to_seconds(self, ticks):
+        segment = np.searchsorted(self.ticks, ticks, side='right') - 1
+        return self.seconds[segment] + (ticks - self.ticks[segment]) * self.seconds_per_tick[segment]
+
+
+def load_midi(path, sample_rate=44100, bar_seconds=2.0):
+    notes = NoteArrays()
+    tempos = []
+    programs = [0] * 16
+    division = None
+    midi_format = 0
+    with open(path, 'rb') as f:
+        if f.read(4) != b'MThd':
+            raise ValueError(f"{path}: not a MIDI file")
+        f.seek(0)
+        for kind, data in read_chunks(f):
+            if kind == b'MThd':
+                if len(data) < 6:
+                    raise ValueError(f"{path}: invalid MIDI header")
+                midi_format, _, division = struct.unpack('>HHH', data[:6])
+            elif kind == b'MTrk':
+                parse_track(data, notes, tempos, programs)
+
+    # Ticks -> échantillons pour toutes les notes d'un coup
+    tempo_map = TempoMap(tempos, division)
+    onsets = tempo_map.to_seconds(np.frombuffer(notes.on, dtype=np.int64))
+    ends = tempo_map.to_seconds(np.frombuffer(notes.off, dtype=np.int64))
+    order = np.argsort(onsets, kind='stable')
+
+    events = np.empty(len(notes), dtype=MIDI_EVENT_DTYPE)
+    events['onset'] = np.rint(onsets[order] * sample_rate)
+    events['duration'] = np.rint((ends - onsets)[order] * sample_rate)
+    events['note'] = np.frombuffer(notes.note, dtype=np.uint8)[order]
+    events['velocity'] = np.frombuffer(notes.velocity, dtype=np.uint8)[order]
+    events['channel'] = np.frombuffer(notes.channel, dtype=np.uint8)[order]
+
+    length = int((events['onset'] + events['duration']).max()) if len(events) else 0
+    header = {
+        "version": FORMAT_VERSION,
+        "sample_rate": sample_rate,
+        "bar_seconds": bar_seconds,
+        "count": len(events),
+        "length": length,
+        "source": os.path.basename(path),
+        "midi_format": midi_format,
+        "division": division,
+        "tempos": [list(change) for change in tempos],
+        "programs": programs,
+    }
+    return CompiledScore(events, header)
+
+
+def midi_events(score, instrument=None):
+    # (temps, note, instrument) pour le Sequencer. Le canal 10 va à la boîte à rythmes ; les autres
+    # suivent leur programme General MIDI, sauf si `instrument` est imposé.
+    programs = score.header.get("programs", [0] * 16)
+    instruments = [instrument or program_instrument(program) for program in programs]
+    instruments[DRUM_CHANNEL] = "drums"
+    onsets = score.events['onset'] / score.sample_rate
+    return [(onset, note_name(note), instruments[channel]) for onset, note, channel in
+            zip(onsets.tolist(), score.events['note'].tolist(), score.events['channel'].tolist())]
+
+
+def write_midi(path, events, note_length=1.0, tempo=DEFAULT_TEMPO, division=DIVISION):
+    # Événements (temps, note, instrument) dans l'ordre du temps, comme un enregistrement.
+    # Fichier de format 0 : une piste, un canal par instrument. Rend le nombre de notes écrites.
+    ticks_per_second = division * 1e6 / tempo
+    length_ticks = max(int(round(note_length * ticks_per_second)), 1)
+    pending = []  # tas (tick du note-off, canal, note)
+    sounding = [-1] * (16 * 128)  # (canal, note) -> tick du note-off attendu
+    programmed = set()
+    count = 0
+    last_tick = 0
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(b'MThd', 6) + struct.pack('>HHH', 0, 1, division))
+        f.write(HEADER.pack(b'MTrk', 0))
+        start = f.tell()
+
+        def write(tick, message):
+            nonlocal last_tick
+            f.write(_vlq(tick - last_tick) + message)
+            last_tick = tick
+
+        def release(until):
+            while pending and pending[0][0] <= until:
+                off, channel, note = heapq.heappop(pending)
+                key = (channel << 7) | note
+                if sounding[key] == off:
+                    sounding[key] = -1
+                    write(off, bytes((0x80 | channel, note, 0)))
+
+        write(0, b'\xff\x51\x03' + tempo.to_bytes(3, 'big'))
+        for time, note, instrument in events:
+            index = note_index(note)
+            if index is None:
+                continue
+            channel, program = INSTRUMENT_CHANNELS.get(instrument, INSTRUMENT_CHANNELS["piano"])
+            tick = max(int(round(time * ticks_per_second)), last_tick)
+            release(tick)
+            if program is not None and channel not in programmed:
+                write(tick, bytes((0xC0 | channel, program)))
+                programmed.add(channel)
+            key = (channel << 7) | index
+            if sounding[key] != -1:
+                # Même note rejouée avant la fin de la précédente : on coupe la précédente d'abord
+                write(tick, bytes((0x80 | channel, index, 0)))
+            write(tick, bytes((0x90 | channel, index, VELOCITY)))
+            sounding[key] = tick + length_ticks
+            heapq.heappush(pending, (tick + length_ticks, channel, index))
+            count += 1
+        release(float('inf'))
+        write(last_tick, b'\xff\x2f\x00')
+
+        # Longueur de la piste, connue seulement à la fin
+        size = f.tell() - start
+        f.seek(start - 4)
+        f.write(struct.pack('>I', size))
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect a MIDI file or export a recording to MIDI.")
+    parser.add_argument("input", help="MIDI file (.mid) or recording (.rec or .json)")
+    parser.add_argument("-o", "--output", help="output .mid file for recordings (default: input name with .mid)")
+    parser.add_argument("--note-length", type=float, default=1.0, help="length of each exported note in seconds")
+    args = parser.parse_args(argv)
+
+    if args.input.endswith((".mid", ".midi")):
+        score = load_midi(args.input)
+        channels = sorted(set(score.events['channel'].tolist()))
+        print(f"{args.input}: {len(score)} notes, {score.duration:.1f}s, "
+              f"{len(score.header['tempos'])} tempo change(s), channels {[c + 1 for c in channels]}")
+    else:
+        output = args.output or os.path.splitext(args.input)[0] + ".mid"
+        count = write_midi(output, load_recording(args.input), args.note_length)
+        print(f"{output}: {count} notes")
+
+
+if __name__ == '__main__':
+    main()
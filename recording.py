@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Enregistrements au format binaire compact (.rec) : un journal en ajout seul, écrit note par note
+pendant la prise, que l'on relit par projection mémoire (np.memmap) pour la lecture et la frise.
+
+    en-tête : b"IREC", version (uint16), taille du JSON (uint32), JSON {"notes": [...], "instruments": [...]}
+    puis des enregistrements de taille fixe : temps (float64), index de note (int16), id d'instrument (uint8)
+
+Un enregistrement incomplet en fin de fichier (arrêt brutal) est ignoré : tout ce qui précède est conservé.
+
+    python recording.py recording_153012.rec              # -> recording_153012.json
+    python recording.py recording_153012.json -o take.rec
+"""
+
+import os
+import sys
+import json
+import struct
+import argparse
+
+import numpy as np
+
+from instrument import note_to_frequency, note_index, note_name, INSTRUMENTS
+
+MAGIC = b"IREC"
+VERSION = 1
+PREFIX = struct.Struct('<4sHI')
+RECORD = struct.Struct('<dhB')
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('note', '<i2'), ('instrument', 'u1')])
+NOTE_NAMES = list(note_to_frequency)
+
+
+class RecordingWriter:
+    # Journal en ajout seul : chaque note est écrite (et vidée vers le système) dès qu'elle est jouée,
+    # la mémoire utilisée ne dépend donc pas de la longueur de la prise
+
+    def __init__(self, path, notes=NOTE_NAMES, instruments=INSTRUMENTS):
+        self.path = path
+        self.notes = list(notes)
+        self.instruments = list(instruments)
+        self.note_index = {name: i for i, name in enumerate(self.notes)}
+        self.instrument_index = {name: i for i, name in enumerate(self.instruments)}
+        self.count = 0
+        self.dropped = 0
+        header = json.dumps({"notes": self.notes, "instruments": self.instruments}).encode('utf-8')
+        self.file = open(path, 'wb')
+        self.file.write(PREFIX.pack(MAGIC, VERSION, len(header)) + header)
+        self.file.flush()
+
+    def append(self, time, note, instrument):
+        # Nom d'instrument tel qu'affiché ("Video Game") ou interne ("video_game"), note sous
+        # n'importe quelle graphie reconnue ("Db4" -> "C#4")
+        instrument = instrument.lower().replace(" ", "_")
+        note_id = self.note_index.get(note)
+        if note_id is None and note_index(note) is not None:
+            note_id = self.note_index.get(note_name(note_index(note)))
+        instrument_id = self.instrument_index.get(instrument)
+        if note_id is None or instrument_id is None:
+            # Les silences ne sont pas enregistrés ; une vraie note perdue est signalée
+            if note_index(note) is not None:
+                self.dropped += 1
+                print(f"Recording: {note} on {instrument} cannot be recorded", file=sys.stderr)
+            return False
+        self.file.write(RECORD.pack(time, note_id, instrument_id))
+        self.file.flush()
+        self.count += 1
+        return True
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    # Lecture d'un journal .rec par np.memmap : rien n'est copié tant qu'on ne lit pas les notes
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            prefix = f.read(PREFIX.size)
+            if len(prefix) < PREFIX.size:
+                raise ValueError(f"{path}: not a recording")
+            magic, version, header_size = PREFIX.unpack(prefix)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path}: not a recording (or unsupported version)")
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        self.notes = header["notes"]
+        self.instruments = header["instruments"]
+
+        offset = PREFIX.size + header_size
+        count = (os.path.getsize(path) - offset) // RECORD_DTYPE.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        notes, instruments = self.notes, self.instruments
+        for time, note, instrument in zip(self.records['time'].tolist(), self.records['note'].tolist(),
+                                          self.records['instrument'].tolist()):
+            yield time, notes[note], instruments[instrument]
+
+    def events(self):
+        # (temps, note, instrument), comme load_score ou le Sequencer
+        return list(self)
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump([{"note": note, "time": time, "instrument": instrument}
+                       for time, note, instrument in self], f, indent=4)
+
+
+def read_json(path):
+    with open(path, 'r') as f:
+        recorded_notes = json.load(f)
+    # Anciens enregistrements : "video game" au lieu de "video_game"
+    return [(note_data["time"], note_data["note"], note_data.get("instrument", "piano").lower().replace(" ", "_"))
+            for note_data in recorded_notes]
+
+
+def write_log(path, events):
+    with RecordingWriter(path) as writer:
+        for time, note, instrument in events:
+            writer.append(time, note, instrument)
+    return writer.count
+
+
+def load_recording(path):
+    # Enregistrement .rec ou ancien .json -> liste (temps, note, instrument)
+    if path.endswith(".json"):
+        return read_json(path)
+    return Recording(path).events()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert recordings between the .rec log and JSON.")
+    parser.add_argument("input", help="recording (.rec or .json)")
+    parser.add_argument("-o", "--output", help="output file (default: input name with the other extension)")
+    args = parser.parse_args(argv)
+
+    stem, ext = os.path.splitext(args.input)
+    if ext == ".json":
+        output = args.output or stem + ".rec"
+        count = write_log(output, read_json(args.input))
+    else:
+        output = args.output or stem + ".json"
+        recording = Recording(args.input)
+        recording.to_json(output)
+        count = len(recording)
+    print(f"{output}: {count} notes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Rendu hors ligne des partitions .txt et des enregistrements (.rec ou .json) vers un fichier WAV,
+beaucoup plus vite que le temps réel et sans interface (PyQt5 n'est pas importé).
+
+    python render.py mario.txt -o mario.wav --instrument xylophone
+    python render.py recording_153012.rec
+    python render.py arrangement.txt          # partition à plusieurs pistes (lignes TRACK)
+    python render.py song.mid                 # fichier MIDI (chaque canal sur l'instrument de son programme)
+"""
+
+import os
+import time
+import wave
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from instrument import MusicPlayer, INSTRUMENTS, note_frequency
+from score import stream_score, load_tracks, is_multitrack
+from recording import load_recording
+from midi import load_midi, midi_events
+
+NOTE_LENGTH = 1.0  # chaque note jouée dure 1 seconde, comme dans les widgets
+
+
+def write_wav(path, blocks, sample_rate):
+    # Écrit des blocs mono float32 en WAV stéréo int16, au fil de l'eau
+    frames = 0
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        for block in blocks:
+            stereo = np.empty((len(block), 2), dtype=np.int16)
+            stereo[:, 0] = block * 32767
+            stereo[:, 1] = stereo[:, 0]
+            wav.writeframes(stereo.tobytes())
+            frames += len(block)
+    return frames
+
+
+class OfflineRenderer:
+
+    def __init__(self, player=None, note_length=NOTE_LENGTH, gain=0.25):
+        self.player = player if player is not None else MusicPlayer(audio=False)
+        self.sample_rate = self.player.sample_rate
+        self.note_length = note_length
+        self.gain = gain
+        self.notes = 0
+        self._tones = {}
+
+    def prepare(self, events):
+        # Rend chaque note distincte une seule fois, toutes les notes d'un instrument en un seul appel
+        missing = {}
+        for _, note, instrument in events:
+            freq = note_frequency(note)
+            if freq and (instrument, freq) not in self._tones:
+                missing.setdefault(instrument, set()).add(freq)
+
+        for instrument, freqs in missing.items():
+            freqs = sorted(freqs)
+            tones = self.player.render_tones(instrument, freqs, self.note_length).astype(np.float32)
+            tones *= self.gain
+            for freq, tone in zip(freqs, tones):
+                self._tones[(instrument, freq)] = tone
+
+    def _tone(self, instrument, frequency):
+        tone = self._tones.get((instrument, frequency))
+        if tone is None:
+            tone = self.player.render_tones(instrument, [frequency], self.note_length)[0].astype(np.float32)
+            tone *= self.gain
+            self._tones[(instrument, frequency)] = tone
+        return tone
+
+    def _placed(self, events):
+        # (échantillon de départ, ton) dans l'ordre chronologique, à l'échantillon près.
+        # Une liste est triée et pré-rendue d'un coup ; un flux (déjà trié) est consommé au fil de l'eau.
+        if isinstance(events, list):
+            self.prepare(events)
+            events = sorted(events, key=lambda event: event[0])
+        for onset, note, instrument in events:
+            freq = note_frequency(note)
+            if freq:
+                self.notes += 1
+                yield int(round(onset * self.sample_rate)), self._tone(instrument, freq)
+
+    def render_blocks(self, events, block_size=44100):
+        # Générateur de blocs mono float32 : seules les notes qui chevauchent le bloc sont gardées
+        # en mémoire et mixées, ce qui permet de rendre des flux de taille arbitraire
+        placed = self._placed(events)
+        upcoming = next(placed, None)
+        active = []
+        block_start = 0
+        while upcoming is not None or active:
+            block_end = block_start + block_size
+            while upcoming is not None and upcoming[0] < block_end:
+                active.append(upcoming)
+                upcoming = next(placed, None)
+            if upcoming is None:
+                # Dernier bloc : il s'arrête à la fin de la dernière note
+                block_end = min(block_end, max(start + len(tone) for start, tone in active))
+            block = np.zeros(block_end - block_start, dtype=np.float32)
+
+            still_active = []
+            for start, tone in active:
+                lo = max(start, block_start)
+                hi = min(start + len(tone), block_end)
+                block[lo - block_start:hi - block_start] += tone[lo - start:hi - start]
+                if start + len(tone) > block_end:
+                    still_active.append((start, tone))
+            active = still_active
+
+            np.clip(block, -1.0, 1.0, out=block)
+            yield block
+            block_start = block_end
+
+    def render(self, events):
+        blocks = list(self.render_blocks(events))
+        if not blocks:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(blocks)
+
+    def length(self, events):
+        # Nombre d'échantillons du rendu, sans rien synthétiser
+        if not events:
+            return 0
+        last_onset = max(onset for onset, _, _ in events)
+        return int(round(last_onset * self.sample_rate)) + int(self.sample_rate * self.note_length)
+
+    def render_into(self, events, out):
+        frames = 0
+        for block in self.render_blocks(events):
+            out[frames:frames + len(block)] = block
+            frames += len(block)
+        return frames
+
+    def write_wav(self, events, path):
+        # Écrit le WAV bloc par bloc : la mémoire ne dépend pas de la longueur du morceau
+        return write_wav(path, self.render_blocks(events), self.sample_rate) / self.sample_rate
+
+
+def render_tracks(tracks, player=None, note_length=NOTE_LENGTH, gain=0.25, workers=None):
+    # Chaque piste est synthétisée sur son propre thread (NumPy/SciPy relâchent le GIL pendant les
+    # calculs), puis les pistes sont mixées avec leur gain. Rend un tableau mono float32.
+    player = player if player is not None else MusicPlayer(audio=False)
+
+    def render_track(track):
+        return OfflineRenderer(player, note_length, gain * track.gain).render(track.events)
+
+    with ThreadPoolExecutor(workers or max(len(tracks), 1), thread_name_prefix="track") as pool:
+        rendered = list(pool.map(render_track, tracks))
+
+    mix = np.zeros(max((len(audio) for audio in rendered), default=0), dtype=np.float32)
+    for audio in rendered:
+        mix[:len(audio)] += audio
+    np.clip(mix, -1.0, 1.0, out=mix)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a .txt score, a recording (.rec/.json) or a MIDI file to WAV, offline.")
+    parser.add_argument("input", help="score (.txt, '-' for stdin), recording (.rec or .json) or MIDI file (.mid)")
+    parser.add_argument("-o", "--output", help="output .wav file (default: input name with .wav)")
+    parser.add_argument("-i", "--instrument", choices=INSTRUMENTS, default="piano",
+                        help="instrument used for .txt scores (recordings keep their own)")
+    parser.add_argument("--gain", type=float, default=0.25, help="gain applied to every note")
+    parser.add_argument("--note-length", type=float, default=NOTE_LENGTH, help="length of each note in seconds")
+    args = parser.parse_args(argv)
+
+    tracks = None
+    if args.input.endswith((".rec", ".json")):
+        events = load_recording(args.input)
+    elif args.input.endswith((".mid", ".midi")):
+        # Les percussions (canal 10) ne sont pas synthétisées hors ligne
+        events = [event for event in midi_events(load_midi(args.input)) if event[2] in INSTRUMENTS]
+    elif args.input != "-" and is_multitrack(args.input):
+        tracks = load_tracks(args.input, args.instrument)
+    else:
+        # Les partitions sont lues en flux : taille quelconque, y compris depuis stdin
+        events = stream_score(args.input, args.instrument)
+    if args.input == "-" and not args.output:
+        parser.error("--output is required when reading from stdin")
+    output = args.output or os.path.splitext(args.input)[0] + ".wav"
+
+    start = time.perf_counter()
+    if tracks is not None:
+        player = MusicPlayer(audio=False)
+        mix = render_tracks(tracks, player, args.note_length, args.gain)
+        seconds = write_wav(output, [mix], player.sample_rate) / player.sample_rate
+        notes = sum(len(track) for track in tracks)
+    else:
+        renderer = OfflineRenderer(note_length=args.note_length, gain=args.gain)
+        seconds = renderer.write_wav(events, output)
+        notes = renderer.notes
+    elapsed = time.perf_counter() - start
+    print(f"{output}: {notes} notes, {seconds:.1f}s of audio in {elapsed:.2f}s "
+          f"({seconds / max(elapsed, 1e-9):.0f}x real time)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Lecture des partitions .txt ("NOTE DURATION" par ligne) et compilation en un format binaire compact :
+un tableau NumPy structuré (départ en échantillons, numéro MIDI de la note, durée en échantillons) plus un en-tête.
+
+Les partitions compilées sont mises en cache dans .score_cache/, retrouvées par date de modification
+puis par empreinte du contenu, si bien que rouvrir une grosse partition est quasi instantané.
+
+Partitions à plusieurs pistes : une ligne "TRACK <instrument> [gain]" ouvre une piste, dont les notes
+suivent et repartent du temps 0. Les pistes sont jouées ensemble (voir render.render_tracks).
+La première ligne TRACK doit figurer dans les MULTITRACK_SCAN_LINES premières lignes : seul le début
+du fichier est lu pour reconnaître une partition à plusieurs pistes.
+
+    TRACK piano 1.0
+    C4 0.5
+    E4 0.5
+    TRACK xylophone 0.6
+    G5 1.0
+"""
+
+import os
+import sys
+import json
+import heapq
+import hashlib
+from itertools import islice
+
+import numpy as np
+
+from instrument import note_index, note_name, user_cache_dir, INSTRUMENTS
+
+REST_NOTES = ('0', 'Unknown')
+TRACK_KEYWORD = "TRACK"
+MULTITRACK_SCAN_LINES = 64
+TEMPO = 1.0  # secondes par unité de durée, comme dans open_score
+
+FORMAT_VERSION = 2  # v2 : les notes sont des numéros MIDI (v1 : index dans note_to_frequency)
+EVENT_DTYPE = np.dtype([('onset', '<i8'), ('note', '<i2'), ('duration', '<i4')])
+CACHE_DIR = user_cache_dir("PyQtPiano", "score_cache")
+CACHE_ENTRIES = 64  # partitions gardées dans l'index ; les plus anciennes compilations sont retirées
+
+
+# Pipeline paresseux lecture -> analyse -> validation -> planification : chaque étape est un
+# générateur, donc une partition (même énorme, ou lue sur stdin) est traitée au fil de l'eau
+# et le premier événement est disponible dès la première ligne lue.
+
+def read_lines(source):
+    # `source` : chemin, "-" pour stdin, ou tout itérable de lignes (fichier ouvert...)
+    if source == "-":
+        yield from sys.stdin
+    elif isinstance(source, str):
+        with open(source, 'r') as f:
+            yield from f
+    else:
+        yield from source
+
+
+def parse_lines(lines):
+    # Lignes "NOTE DURATION" ; les lignes invalides sont ignorées
+    for line in lines:
+        parts = line.strip().split()
+        if len(parts) != 2:
+            continue
+
+        note, duration_str = parts
+        try:
+            duration = float(duration_str)
+        except ValueError:
+            continue
+        yield note, duration
+
+
+def validate_notes(pairs):
+    # Silences "0" / "Unknown" et notes inconnues : seul le temps avance.
+    # Donne (temps, note, durée) en secondes.
+    time_offset = 0.0
+    for note, duration in pairs:
+        if note in REST_NOTES:
+            time_offset += duration * TEMPO
+            continue
+
+        if note_index(note) is None:
+            print(f"Skipping unknown note: {note}", file=sys.stderr)
+            continue
+
+        yield time_offset, note, duration * TEMPO
+        time_offset += duration * TEMPO
+
+
+def schedule_notes(notes, instrument="piano"):
+    for onset, note, _ in notes:
+        yield onset, note, instrument
+
+
+def iter_score(lines):
+    return validate_notes(parse_lines(lines))
+
+
+def stream_score(source, instrument="piano"):
+    return schedule_notes(iter_score(read_lines(source)), instrument)
+
+
+def parse_score(lines, instrument="piano"):
+    return list(schedule_notes(iter_score(lines), instrument))
+
+
+def load_score(path, instrument="piano"):
+    # Une partition à plusieurs pistes donne les notes de toutes ses pistes, dans l'ordre du temps
+    if is_multitrack(path):
+        return merge_tracks(load_tracks(path, instrument))
+    with open(path, 'r') as f:
+        return parse_score(f, instrument)
+
+
+class Track:
+
+    def __init__(self, instrument, gain=1.0):
+        self.instrument = instrument
+        self.gain = gain
+        self.events = []  # (temps, note, instrument)
+
+    def __len__(self):
+        return len(self.events)
+
+
+def is_track_line(parts):
+    # `parts` : la ligne découpée par split()
+    return bool(parts) and parts[0] == TRACK_KEYWORD
+
+
+def is_multitrack(path):
+    # Ne lit que le début du fichier : une grosse partition ordinaire part aussitôt en lecture en flux
+    with open(path, 'r') as f:
+        return any(is_track_line(line.split()) for line in islice(f, MULTITRACK_SCAN_LINES))
+
+
+def parse_tracks(lines, instrument="piano"):
+    # Les notes avant la première ligne TRACK forment une piste jouée sur `instrument`
+    track_lines = [(Track(instrument), [])]
+    for line in lines:
+        parts = line.split()
+        if is_track_line(parts):
+            if len(parts) < 2 or parts[1] not in INSTRUMENTS:
+                raise ValueError(f"Invalid track line: {line.strip()!r} (instruments: {', '.join(INSTRUMENTS)})")
+            gain = float(parts[2]) if len(parts) > 2 else 1.0
+            track_lines.append((Track(parts[1], gain), []))
+        else:
+            track_lines[-1][1].append(line)
+
+    tracks = []
+    for track, lines in track_lines:
+        track.events = parse_score(lines, track.instrument)
+        if track.events:
+            tracks.append(track)
+    return tracks
+
+
+def load_tracks(path, instrument="piano"):
+    with open(path, 'r') as f:
+        return parse_tracks(f, instrument)
+
+
+def merge_tracks(tracks):
+    return list(heapq.merge(*(track.events for track in tracks), key=lambda event: event[0]))
+
+
+class CompiledScore:
+
+    def __init__(self, events, header):
+        self.events = events
+        self.header = header
+        self.sample_rate = header["sample_rate"]
+        # Index temporel : premier événement de chaque mesure
+        bar_samples = int(round(header["bar_seconds"] * self.sample_rate))
+        bars = int(header["length"] // bar_samples) + 1 if bar_samples else 1
+        self.bar_samples = bar_samples
+        self.bar_index = np.searchsorted(events['onset'], np.arange(bars, dtype=np.int64) * bar_samples)
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def duration(self):
+        return self.header["length"] / self.sample_rate
+
+    def note_names(self):
+        return [note_name(i) for i in self.events['note'].tolist()]
+
+    def to_events(self, instrument="piano", start=0):
+        # Événements (temps, note, instrument) pour le Sequencer, à partir de l'événement `start`
+        onsets = self.events['onset'][start:] / self.sample_rate
+        return [(onset, note_name(note), instrument) for onset, note in zip(onsets.tolist(), self.events['note'][start:].tolist())]
+
+    def seek_index(self, seconds):
+        # Premier événement à partir de `seconds`, par recherche dichotomique
+        return int(np.searchsorted(self.events['onset'], int(round(seconds * self.sample_rate))))
+
+    def bar_start(self, bar):
+        bar = min(max(bar, 0), len(self.bar_index) - 1)
+        return int(self.bar_index[bar])
+
+    def save(self, path):
+        header = np.frombuffer(json.dumps(self.header).encode('utf-8'), dtype=np.uint8)
+        with open(path, 'wb') as f:
+            np.savez(f, header=header, events=self.events)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(data['header'].tobytes().decode('utf-8'))
+            events = data['events']
+        return cls(events, header)
+
+
+def _compile_lines(lines, sample_rate, bar_seconds, source_hash):
+    # Colonnes remplies en une passe par np.fromiter, puis converties en échantillons d'un bloc
+    rows = ((onset, note_index(note), duration) for onset, note, duration in iter_score(lines))
+    columns = np.fromiter(rows, dtype=[('onset', '<f8'), ('note', '<i2'), ('duration', '<f8')])
+    events = np.empty(len(columns), dtype=EVENT_DTYPE)
+    events['onset'] = np.rint(columns['onset'] * sample_rate)
+    events['note'] = columns['note']
+    events['duration'] = np.rint(columns['duration'] * sample_rate)
+    length = int((events['onset'] + events['duration']).max()) if len(events) else 0
+    header = {
+        "version": FORMAT_VERSION,
+        "sample_rate": sample_rate,
+        "bar_seconds": bar_seconds,
+        "count": len(events),
+        "length": length,
+        "source": source_hash,
+    }
+    return CompiledScore(events, header)
+
+
+def _read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "index.json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(cache_dir, index):
+    tmp_path = os.path.join(cache_dir, "index.json.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(cache_dir, "index.json"))
+
+
+def _prune_cache(cache_dir, index):
+    # Index borné à CACHE_ENTRIES (ordre d'insertion = ordre de compilation), puis suppression des
+    # .npz qu'aucune entrée restante ne référence
+    for path in list(index)[:max(len(index) - CACHE_ENTRIES, 0)]:
+        del index[path]
+    referenced = {entry[2] for entry in index.values()}
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npz") and name.split("_", 1)[0] not in referenced:
+            os.remove(os.path.join(cache_dir, name))
+
+
+def compile_score(path, sample_rate=44100, bar_seconds=2.0, cache_dir=CACHE_DIR):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    index = _read_index(cache_dir) if cache_dir else {}
+
+    def cached(source_hash):
+        cache_path = os.path.join(cache_dir, f"{source_hash}_{sample_rate}_{bar_seconds}.npz")
+        if not os.path.exists(cache_path):
+            return cache_path, None
+        try:
+            score = CompiledScore.load(cache_path)
+        except (OSError, ValueError, KeyError):
+            return cache_path, None
+        if score.header.get("version") != FORMAT_VERSION:
+            return cache_path, None
+        return cache_path, score
+
+    # 1. Fichier inchangé depuis la dernière fois (même mtime et taille) : pas besoin de le relire
+    entry = index.get(path)
+    if cache_dir and entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+        _, score = cached(entry[2])
+        if score is not None:
+            return score
+
+    # 2. Sinon on hache le contenu : un fichier touché mais identique réutilise la même compilation
+    with open(path, 'rb') as f:
+        content = f.read()
+    source_hash = hashlib.sha1(content).hexdigest()
+    score = None
+    if cache_dir:
+        cache_path, score = cached(source_hash)
+    if score is None:
+        score = _compile_lines(content.decode('utf-8', errors='replace').splitlines(), sample_rate, bar_seconds, source_hash)
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                score.save(cache_path)
+            except OSError:
+                # Cache inutilisable (lecture seule...) : la partition compilée reste valable
+                return score
+
+    if cache_dir:
+        index.pop(path, None)
+        index[path] = [stat.st_mtime_ns, stat.st_size, source_hash]
+        try:
+            _prune_cache(cache_dir, index)
+            _write_index(cache_dir, index)
+        except OSError:
+            pass
+    return score
@@ -1,11 +1,25 @@
-import sys, time, json
+import sys, time, threading
+# Profil de démarrage : (étape, instant) ; voir startup_report et --startup-report
+startup_marks = [("start", time.perf_counter())]
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QPushButton, QLabel, QSpinBox,
-    QVBoxLayout, QHBoxLayout, QToolBar, QAction, QFileDialog, QMessageBox, QStackedWidget
+    QVBoxLayout, QHBoxLayout, QGridLayout, QToolBar, QAction, QFileDialog, QMessageBox, QStackedWidget
 )
-from PyQt5.QtCore import Qt, QSize, QTimer, QSettings
-from PyQt5.QtGui import QFont
-from instrument import note_to_frequency, MusicPlayer
+from PyQt5.QtCore import Qt, QEvent, QSize, QRect, QTimer, QSettings, QStandardPaths, QObject, pyqtSignal
+from PyQt5.QtGui import QFont, QPainter, QColor, QPen
+startup_marks.append(("import PyQt5", time.perf_counter()))
+from instrument import note_to_frequency, note_frequency, MusicPlayer
+from score import compile_score, stream_score, load_tracks, is_multitrack
+from render import render_tracks
+from recording import RecordingWriter, Recording, load_recording
+from drums import DrumKit, StepSequencer
+from midi import load_midi, midi_events, write_midi
+startup_marks.append(("import instrument", time.perf_counter()))
 from datetime import datetime
 from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QScrollArea, QFrame
@@ -19,6 +33,53 @@ note_order = ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'C5']
 color_map = ['#9400D3', '#4B0082', '#0000FF', '#00FF00', '#FFFF00', '#FFA500', '#FF0000', '#FF69B4']
 black_notes = ['C#', 'D#', 'F#', 'G#', 'A#']
 full_note_order = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+STREAM_THRESHOLD = 1024 * 1024  # au-delà (en octets), les partitions sont lues en flux
+HEAVY_MODULES = ['numpy', 'pygame', 'scipy']
+
+
+def startup_report(marks, budget_ms=None):
+    # Durée de chaque étape du démarrage et modules lourds déjà chargés à la fin
+    start = previous = marks[0][1]
+    lines = []
+    for label, instant in marks[1:]:
+        lines.append(f"{label:20s} {1000 * (instant - previous):8.1f} ms   (total {1000 * (instant - start):8.1f} ms)")
+        previous = instant
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    deferred = [name for name in HEAVY_MODULES if name not in sys.modules]
+    lines.append(f"loaded at startup: {', '.join(loaded) or '-'}   deferred: {', '.join(deferred) or '-'}")
+    total = 1000 * (previous - start)
+    if budget_ms is not None:
+        status = "OK" if total <= budget_ms else "OVER BUDGET"
+        lines.append(f"{status}: {total:.0f} ms / {budget_ms:.0f} ms")
+    return "\n".join(lines), total
+
+# Feuille de style partagée par toutes les touches (posée une fois sur le PianoWidget) :
+# les propriétés "black" et "lit" choisissent l'apparence, sans feuille de style par touche
+PIANO_KEY_STYLE = """
+    QPushButton {
+        background-color: white;
+        color: black;
+        border: 1px solid #aaa;
+        text-align: bottom center;
+        padding-bottom: 18px;
+    }
+    QPushButton:pressed {
+        background-color: #ddd;
+    }
+    QPushButton[black="true"] {
+        background-color: black;
+        color: white;
+        border: 1px solid #222;
+        padding-bottom: 6px;
+    }
+    QPushButton[black="true"]:pressed {
+        background-color: #444;
+    }
+    QPushButton[lit="true"] {
+        background-color: #aaffaa;
+    }
+"""
+
 
 class PianoKey(QPushButton):
     def __init__(self, note, is_black=False, parent=None):
@@ -27,82 +88,147 @@ class PianoKey(QPushButton):
         self.setFont(QFont('Arial', 9, QFont.Bold))
         self.setFixedSize(QSize(30, 90) if is_black else QSize(45, 200))
         self.setText(french_map[note[:-1]])
-        self.setStyleSheet(f"""
-            QPushButton {{
-                background-color: {'black' if is_black else 'white'};
-                color: {'white' if is_black else 'black'};
-                border: 1px solid {'#222' if is_black else '#aaa'};
-                text-align: bottom center;
-                padding-bottom: {18 if not is_black else 6}px;
-            }}
-            QPushButton:pressed {{
-                background-color: {'#444' if is_black else '#ddd'};
-            }}
-        """)
+        self.lit = False
+        self.setProperty("black", is_black)
+        self.setProperty("lit", False)
 
         if is_black:
             self.raise_()
-    
-    def flash(self, color="#aaffaa", duration=100):
-        original_style = self.styleSheet()
-        self.setStyleSheet(original_style + f"background-color: {color};")
 
-        QTimer.singleShot(duration, lambda: self.setStyleSheet(original_style))
+    def set_lit(self, lit):
+        if lit == self.lit:
+            return
+        self.lit = lit
+        self.setProperty("lit", lit)
+        # Ré-applique la feuille de style partagée avec la nouvelle valeur de propriété
+        self.style().unpolish(self)
+        self.style().polish(self)
 
 class PianoWidget(QWidget):
+    FLASH_MS = 100
+    FRAME_MS = 16  # les flashs sont appliqués au plus une fois par image (~60 fps)
+    FIRST_OCTAVE = 4
+
     def __init__(self, player, note_callback=None, octaves=2):
         super().__init__()
         self.player = player
         self.note_callback = note_callback
-        self.octaves = octaves
+        self.octaves = 0
         self.get_current_instrument = None
         self.white_key_width = 45
         self.white_key_height = 200
         self.black_key_width = 30
         self.black_key_height = 100
-        self.build_keys()
-
-    def build_keys(self):
-        total_white_keys = 7 * self.octaves
-        self.setFixedSize(total_white_keys * self.white_key_width, self.white_key_height)
+        self.setStyleSheet(PIANO_KEY_STYLE)
+        # Flashs en attente / touches allumées (touche -> fin du flash)
+        self.pending_flashes = set()
+        self.lit_keys = {}
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setInterval(self.FRAME_MS)
+        self.frame_timer.timeout.connect(self.update_flashes)
         self.white_keys = []
         self.black_keys = []
-        white_x = 0
-
-        for octave in range(4, 4 + self.octaves):
-            for note in full_note_order:
-                full_note = f"{note}{octave}"
-                if note in black_notes:
-                    continue
-                key = PianoKey(full_note, is_black=False, parent=self)
-                key.move(white_x, 0)
-                key.clicked.connect(lambda _, n=full_note: self.play_note(n))
-                self.white_keys.append(key)
-                white_x += self.white_key_width
+        self.key_index = {}  # "C#4" -> PianoKey
+        self.octave_keys = {}  # octave -> touches de cette octave
+        # Les octaves de départ ne sont pas préchargées : rien ne doit retarder la première image
+        self.prefetch_octaves = False
+        self.set_octaves(octaves)
+        self.prefetch_octaves = True
+
+    def set_octaves(self, octaves):
+        # Ajoute ou retire seulement les octaves qui changent : les autres touches restent en place
+        if octaves == self.octaves:
+            return
+        self.setUpdatesEnabled(False)
+        first = self.FIRST_OCTAVE
+        for octave in range(first + self.octaves, first + octaves):
+            self.add_octave(octave)
+        for octave in range(first + octaves, first + self.octaves):
+            self.remove_octave(octave)
+        self.octaves = octaves
+        self.setFixedSize(7 * octaves * self.white_key_width, self.white_key_height)
+        self.setUpdatesEnabled(True)
+
+    def add_octave(self, octave):
+        keys = []
+        white_x = (octave - self.FIRST_OCTAVE) * 7 * self.white_key_width
+        for note in full_note_order:
+            full_note = f"{note}{octave}"
+            if note in black_notes:
+                continue
+            key = PianoKey(full_note, is_black=False, parent=self)
+            key.move(white_x, 0)
+            key.clicked.connect(lambda _, n=full_note: self.play_note(n))
+            self.white_keys.append(key)
+            keys.append(key)
+            white_x += self.white_key_width
 
         offset_map = {'C#': 0.7, 'D#': 1.7, 'F#': 3.7, 'G#': 4.7, 'A#': 5.7}
-        for octave in range(4, 4 + self.octaves):
-            for note, pos in offset_map.items():
-                full_note = f"{note}{octave}"
-                x = int(((octave - 4) * 7 + pos) * self.white_key_width) - self.black_key_width // 2
-                key = PianoKey(full_note, is_black=True, parent=self)
-                key.move(x, 0)
-                key.clicked.connect(lambda _, n=full_note: self.play_note(n))
-                self.black_keys.append(key)
-
-    def play_note(self, note):
-        if note in note_to_frequency:
-            freq = note_to_frequency[note]
-            if isinstance(freq, tuple):
-                freq = freq[0]
-            self.player.play_piano_tone(freq, 1.0)
-
-            for key in self.findChildren(PianoKey):
-                if key.note + '4' == note:  
-                    key.flash()
-                    break
+        for note, pos in offset_map.items():
+            full_note = f"{note}{octave}"
+            x = int(((octave - self.FIRST_OCTAVE) * 7 + pos) * self.white_key_width) - self.black_key_width // 2
+            key = PianoKey(full_note, is_black=True, parent=self)
+            key.move(x, 0)
+            key.clicked.connect(lambda _, n=full_note: self.play_note(n))
+            self.black_keys.append(key)
+            keys.append(key)
+
+        for key in keys:
+            self.key_index[key.note] = key
+            key.show()
+        self.octave_keys[octave] = keys
+        # Les sons d'une octave ajoutée sont préparés en tâche de fond avant qu'on les joue
+        if self.prefetch_octaves:
+            self.player.prefetch("piano", [note_frequency(key.note) for key in keys], 1.0)
+
+    def remove_octave(self, octave):
+        keys = self.octave_keys.pop(octave)
+        removed = set(keys)
+        self.white_keys = [key for key in self.white_keys if key not in removed]
+        self.black_keys = [key for key in self.black_keys if key not in removed]
+        for key in keys:
+            del self.key_index[key.note]
+            self.lit_keys.pop(key, None)
+            self.pending_flashes.discard(key)
+            key.deleteLater()
+
+    def play_note(self, note, sound=True):
+        # sound=False : la note est déjà jouée en note tenue, on ne fait que l'afficher
+        freq = note_frequency(note)
+        if freq:
+            self.player.latency.mark("lookup")
+            if sound:
+                self.player.play_piano_tone(freq, 1.0)
+
+            key = self.key_index.get(note)
+            if key is not None:
+                self.flash_key(key)
+            self.player.latency.mark("flash")
             if self.note_callback:
                 self.note_callback(note)
+
+    def flash_key(self, key):
+        # Le flash est seulement programmé : update_flashes l'appliquera à la prochaine image
+        self.lit_keys[key] = time.perf_counter() + self.FLASH_MS / 1000
+        self.pending_flashes.add(key)
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    def update_flashes(self):
+        now = time.perf_counter()
+        expired = [key for key, until in self.lit_keys.items() if until <= now]
+        if self.pending_flashes or expired:
+            # Toutes les touches changées de l'image sont redessinées en un seul repaint
+            self.setUpdatesEnabled(False)
+            for key in self.pending_flashes:
+                key.set_lit(True)
+            for key in expired:
+                key.set_lit(False)
+                del self.lit_keys[key]
+            self.pending_flashes.clear()
+            self.setUpdatesEnabled(True)
+        if not self.lit_keys:
+            self.frame_timer.stop()
                     
 
 class XylophoneWidget(QWidget):
@@ -151,8 +277,8 @@ class XylophoneWidget(QWidget):
 
     def play(self, note):
         full_note = note if note in note_to_frequency else f"{note}4"
-        freq = note_to_frequency.get(full_note)
-        if isinstance(freq, tuple): freq = freq[0]
+        freq = note_frequency(full_note)
+        self.player.latency.mark("lookup")
         if freq:
             self.player.play_xylophone_tone(freq, 1.0)
         if self.note_callback:
@@ -237,18 +363,22 @@ class VideoGameWidget(QWidget):
         outer.addStretch()
         self.setLayout(outer)
 
+        self.sequencer = Sequencer(self.play_melody_note, self)
+
     def play_melody(self, notes):
+        events = []
         time_offset = 0
         for note, duration in notes:
-            def play_later(n=note, d=duration):
-                freq = note_to_frequency.get(n)
-                if isinstance(freq, tuple): freq = freq[0]
-                if freq:
-                    self.player.play_videoGame_tone(freq, duration)
-                    if self.note_callback:
-                        self.note_callback(n)
-            QTimer.singleShot(int(time_offset * 1000), play_later)
+            events.append((time_offset, note, duration))
             time_offset += duration
+        self.sequencer.play(events)
+
+    def play_melody_note(self, note, duration):
+        freq = note_frequency(note)
+        if freq:
+            self.player.play_videoGame_tone(freq, duration)
+            if self.note_callback:
+                self.note_callback(note)
 
 
     def resizeEvent(self, event):
@@ -258,72 +388,551 @@ class VideoGameWidget(QWidget):
                 child.resize(self.size())
         super().resizeEvent(event)
 
-    def play(self, note):
-        freq = note_to_frequency.get(note)
-        if isinstance(freq, tuple): freq = freq[0]
-        if freq:
+    def play(self, note, sound=True):
+        freq = note_frequency(note)
+        self.player.latency.mark("lookup")
+        if freq and sound:
             self.player.play_videoGame_tone(freq, 1.0)
         if self.note_callback:
             self.note_callback(note)
 
 
+class GuitarWidget(QWidget):
+    # Six cordes à vide et quelques accords grattés. Un accord est rendu en une fois par le moteur
+    # à lignes à retard (toutes les cordes ensemble), puis gardé en cache comme une note
+    OPEN_STRINGS = ['E2', 'A2', 'D3', 'G3', 'B3', 'E4']
+    CHORDS = {
+        'C': ['C3', 'E3', 'G3', 'C4', 'E4'],
+        'G': ['G2', 'B2', 'D3', 'G3', 'B3', 'G4'],
+        'D': ['D3', 'A3', 'D4', 'F#4'],
+        'Am': ['A2', 'E3', 'A3', 'C4', 'E4'],
+        'Em': ['E2', 'B2', 'E3', 'G3', 'B3', 'E4'],
+        'F': ['F2', 'C3', 'F3', 'A3', 'C4', 'F4'],
+    }
+
+    def __init__(self, player, note_callback=None):
+        super().__init__()
+        self.player = player
+        self.note_callback = note_callback
+        main_layout = QVBoxLayout()
+        main_layout.setContentsMargins(20, 20, 20, 20)
+        main_layout.addStretch()
+
+        # Cordes : de la plus grave (en haut, la plus épaisse) à la plus aiguë
+        for i, note in enumerate(self.OPEN_STRINGS):
+            btn = QPushButton(f"{french_map[note[:-1]]} ({note})")
+            btn.setFixedHeight(28)
+            btn.setStyleSheet(f"""
+                QPushButton {{
+                    background-color: #F5DEB3;
+                    border: none;
+                    border-bottom: {6 - i}px solid #8B5A2B;
+                    text-align: left;
+                    padding-left: 10px;
+                }}
+                QPushButton:pressed {{
+                    background-color: #8B5A2B;
+                    color: white;
+                }}
+            """)
+            btn.clicked.connect(lambda _, n=note: self.play(n))
+            main_layout.addWidget(btn)
+
+        chord_row = QHBoxLayout()
+        chord_row.addStretch()
+        for name in self.CHORDS:
+            btn = QPushButton(name)
+            btn.setFont(QFont('Arial', 12, QFont.Bold))
+            btn.setFixedSize(60, 40)
+            btn.clicked.connect(lambda _, c=name: self.strum(c))
+            chord_row.addWidget(btn)
+        chord_row.addStretch()
+        main_layout.addSpacing(15)
+        main_layout.addLayout(chord_row)
+        main_layout.addStretch()
+        self.setLayout(main_layout)
+
+    def play(self, note, sound=True):
+        freq = note_frequency(note)
+        self.player.latency.mark("lookup")
+        if freq and sound:
+            self.player.play_guitar_tone(freq, 1.0)
+        if self.note_callback:
+            self.note_callback(note)
+
+    def strum(self, chord):
+        notes = self.CHORDS[chord]
+        self.player.play_strum([note_frequency(note) for note in notes], 1.0)
+        if self.note_callback:
+            for note in notes:
+                self.note_callback(note)
+
+
+
+# Pads et pas du séquenceur : une feuille de style pour tout le DrumWidget
+DRUM_STYLE = """
+    QPushButton[pad="true"] {
+        background-color: #444;
+        color: white;
+        border-radius: 8px;
+    }
+    QPushButton[pad="true"]:pressed {
+        background-color: #FF8C00;
+    }
+    QPushButton[step="true"] {
+        background-color: #ddd;
+        border: 1px solid #aaa;
+    }
+    QPushButton[step="true"][downbeat="true"] {
+        background-color: #bbb;
+    }
+    QPushButton[step="true"]:checked {
+        background-color: #FF8C00;
+    }
+"""
+
+
+class DrumWidget(QWidget):
+    # Pads (un coup = une ligne de la banque memory-map) et séquenceur pas à pas bouclé.
+    # Chaque modification du motif remplace la mesure bouclée, pré-mixée une seule fois par motif.
+    DEFAULT_PATTERN = {
+        "kick": [0, 8],
+        "snare": [4, 12],
+        "closed_hat": [0, 2, 4, 6, 8, 10, 12, 14],
+    }
+
+    def __init__(self, player, kit_dir=None):
+        super().__init__()
+        self.player = player
+        self.kit = DrumKit(player.sample_rate, kit_dir)
+        self.sequencer = StepSequencer(self.kit)
+        for sound, steps in self.DEFAULT_PATTERN.items():
+            for step in steps:
+                self.sequencer.set_step(sound, step)
+        self.playing = False
+        self.setStyleSheet(DRUM_STYLE)
+
+        main_layout = QVBoxLayout()
+        main_layout.setContentsMargins(20, 20, 20, 20)
+
+        pad_row = QHBoxLayout()
+        for sound in self.kit.sounds:
+            pad = QPushButton(sound.replace("_", " ").title())
+            pad.setProperty("pad", True)
+            pad.setFixedSize(100, 60)
+            pad.clicked.connect(lambda _, s=sound: self.hit(s))
+            pad_row.addWidget(pad)
+        pad_row.addStretch()
+        main_layout.addLayout(pad_row)
+
+        grid = QGridLayout()
+        grid.setSpacing(3)
+        for row, sound in enumerate(self.kit.sounds):
+            grid.addWidget(QLabel(sound.replace("_", " ")), row, 0)
+            for step in range(self.sequencer.steps):
+                cell = QPushButton()
+                cell.setCheckable(True)
+                cell.setProperty("step", True)
+                cell.setProperty("downbeat", step % self.sequencer.steps_per_beat == 0)
+                cell.setFixedSize(26, 26)
+                cell.setChecked(bool(self.sequencer.pattern[row, step]))
+                cell.toggled.connect(lambda on, s=sound, i=step: self.set_step(s, i, on))
+                grid.addWidget(cell, row, step + 1)
+        main_layout.addLayout(grid)
+
+        controls = QHBoxLayout()
+        self.play_button = QPushButton("▶ Loop")
+        self.play_button.setFixedWidth(100)
+        self.play_button.clicked.connect(self.toggle_loop)
+        controls.addWidget(self.play_button)
+        controls.addWidget(QLabel("BPM:"))
+        self.bpm_spinbox = QSpinBox()
+        self.bpm_spinbox.setRange(60, 200)
+        self.bpm_spinbox.setValue(self.sequencer.bpm)
+        self.bpm_spinbox.valueChanged.connect(self.set_bpm)
+        controls.addWidget(self.bpm_spinbox)
+        controls.addStretch()
+        main_layout.addLayout(controls)
+        main_layout.addStretch()
+        self.setLayout(main_layout)
+
+    def hit(self, sound):
+        self.player.play_sample(("drums", sound), self.kit.sample(sound))
+
+    def play(self, note, sound=True):
+        # Notes General MIDI des percussions ("C2" -> grosse caisse), comme les partitions et le MIDI
+        drum = self.kit.sound_for_note(note)
+        if drum and sound:
+            self.hit(drum)
+
+    def set_step(self, sound, step, on):
+        self.sequencer.set_step(sound, step, on)
+        self.update_loop()
+
+    def set_bpm(self, bpm):
+        self.sequencer.set_bpm(bpm)
+        self.update_loop()
+
+    def update_loop(self):
+        if self.playing:
+            self.player.play_loop(self.sequencer.bar())
+
+    def toggle_loop(self):
+        self.playing = not self.playing
+        if self.playing:
+            self.update_loop()
+            self.play_button.setText("⏹ Stop")
+        else:
+            self.player.stop_loop()
+            self.play_button.setText("▶ Loop")
+
 
 class RecordingTimeline(QWidget):
+    # Modèle compact (tableaux parallèles) + dessin direct : seules les cases visibles sont peintes,
+    # au lieu d'un QLabel par note
+    CELL_WIDTH = 40
+    CELL_HEIGHT = 30
+    SPACING = 5
+    MARGIN = 10
+    COLORS = {
+        "piano": "#87CEEB",       # sky blue
+        "xylophone": "#FFD700",   # gold
+        "video_game": "#A020F0",  # purple
+        "guitar": "#CD853F"       # peru
+    }
+
     def __init__(self):
         super().__init__()
-        self.layout = QHBoxLayout()
-        self.layout.setSpacing(5)
-        self.layout.setContentsMargins(10, 10, 10, 10)
-        self.setLayout(self.layout)
         self.setMinimumHeight(60)
+        self.instruments = []  # id -> nom d'instrument
+        self.instrument_ids = {}
+        self.brushes = []
+        self.clear()
 
     def clear(self):
-        while self.layout.count():
-            item = self.layout.takeAt(0)
-            widget = item.widget()
-            if widget:
-                widget.deleteLater()
+        self.times = array('d')
+        self.notes = []
+        self.instrument_of = array('B')
+        self.highlighted = set()
+        self.setMinimumWidth(0)
+        self.update()
+
+    def __len__(self):
+        return len(self.times)
+
+    def set_events(self, events):
+        # Remplit la frise d'un coup (enregistrement rouvert), une seule mise à jour de taille
+        self.clear()
+        for timestamp, note, instrument in events:
+            self.times.append(timestamp)
+            self.notes.append(note)
+            self.instrument_of.append(self.instrument_id(instrument))
+        if self.times:
+            self.setMinimumWidth(self.cell_rect(len(self.times) - 1).right() + 1 + self.MARGIN)
+
+    def cell_rect(self, index):
+        x = self.MARGIN + index * (self.CELL_WIDTH + self.SPACING)
+        y = max(self.MARGIN, (self.height() - self.CELL_HEIGHT) // 2)
+        return QRect(x, y, self.CELL_WIDTH, self.CELL_HEIGHT)
+
+    def instrument_id(self, instrument):
+        if instrument not in self.instrument_ids:
+            self.instrument_ids[instrument] = len(self.instruments)
+            self.instruments.append(instrument)
+            self.brushes.append(QColor(self.COLORS.get(instrument, "#CCCCCC")))
+        return self.instrument_ids[instrument]
 
     def add_event(self, note, timestamp, instrument):
-        label = QLabel(f"{note}")
-        label.setFixedSize(40, 30)
-        label.setAlignment(Qt.AlignCenter)
-        label.setObjectName(f"{note}_{instrument}_{timestamp}")  
+        self.times.append(timestamp)
+        self.notes.append(note)
+        self.instrument_of.append(self.instrument_id(instrument))
+
+        index = len(self.times) - 1
+        self.setMinimumWidth(self.cell_rect(index).right() + 1 + self.MARGIN)
+        self.update(self.cell_rect(index))
+
+    def find(self, note, instrument, timestamp):
+        # Index par temps (les notes sont enregistrées dans l'ordre) : recherche dichotomique
+        instrument_id = self.instrument_ids.get(instrument)
+        i = bisect_left(self.times, timestamp)
+        while i < len(self.times) and self.times[i] == timestamp:
+            if self.notes[i] == note and self.instrument_of[i] == instrument_id:
+                return i
+            i += 1
+        return None
 
-        color = {
-            "piano": "#87CEEB",       # sky blue
-            "xylophone": "#FFD700",   # gold
-            "video_game": "#A020F0"   # purple
-        }.get(instrument, "#CCCCCC")
+    def flash_label(self, note, instrument, timestamp):
+        index = self.find(note, instrument, timestamp)
+        if index is None:
+            return
+        self.highlighted.add(index)
+        self.update(self.cell_rect(index))
+        QTimer.singleShot(300, lambda: self.unflash(index))
 
-        label.setStyleSheet(f"background-color: {color}; border: 1px solid black;")
-        self.layout.addWidget(label)
+    def unflash(self, index):
+        self.highlighted.discard(index)
+        self.update(self.cell_rect(index))
 
-    def flash_label(self, note, instrument, timestamp):
-        target_name = f"{note}_{instrument}_{timestamp}"
-        for i in range(self.layout.count()):
-            widget = self.layout.itemAt(i).widget()
-            if widget and widget.objectName() == target_name:
-                original = widget.styleSheet()
-                widget.setStyleSheet("background-color: lime; border: 2px solid black;")
-                QTimer.singleShot(300, lambda w=widget, s=original: w.setStyleSheet(s))
+    def paintEvent(self, event):
+        if not self.times:
+            return
+        area = event.rect()
+        step = self.CELL_WIDTH + self.SPACING
+        first = max(0, (area.left() - self.MARGIN) // step)
+        last = min(len(self.times), (area.right() - self.MARGIN) // step + 1)
+
+        painter = QPainter(self)
+        thin = QPen(Qt.black, 1)
+        thick = QPen(Qt.black, 2)
+        for i in range(first, last):
+            rect = self.cell_rect(i)
+            if i in self.highlighted:
+                painter.fillRect(rect, QColor("lime"))
+                painter.setPen(thick)
+            else:
+                painter.fillRect(rect, self.brushes[self.instrument_of[i]])
+                painter.setPen(thin)
+            painter.drawRect(rect.adjusted(0, 0, -1, -1))
+            painter.drawText(rect, Qt.AlignCenter, self.notes[i])
+
+
+
+
+class Sequencer(QObject):
+    # Séquenceur unique pour les partitions, enregistrements et mélodies : un seul QTimer précis,
+    # réarmé sur le prochain événement, au lieu d'un QTimer.singleShot par note.
+    # Les événements sont des tuples (temps en secondes, *arguments de dispatch), triés par temps.
+    # Seule une fenêtre bornée d'événements à venir est gardée, remplie au fur et à mesure
+    # depuis la source (liste triée ou flux paresseux).
+    finished = pyqtSignal()
+
+    def __init__(self, dispatch, parent=None, lookahead=0.002, jitter_history=1000, window=64):
+        super().__init__(parent)
+        self.dispatch = dispatch
+        self.lookahead = lookahead
+        self.window = window
+        self.events = None      # liste complète (seek arrière possible), None pour un flux
+        self.upcoming = deque()
+        self._source = iter(())
+        self.jitter = deque(maxlen=jitter_history)
+        self._origin = None     # perf_counter correspondant au temps 0 de la partition
+        self._paused_at = None
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self._tick)
+
+    def play(self, events):
+        self._start(sorted(events, key=lambda event: event[0]))
+
+    def play_stream(self, events):
+        # Flux d'événements déjà dans l'ordre chronologique : la lecture démarre
+        # dès les premiers événements, sans attendre la fin de la source
+        self._start(None, iter(events))
+
+    def _start(self, events, source=None):
+        self.stop()
+        self.events = events
+        self._source = iter(events) if source is None else source
+        self.upcoming.clear()
+        self.jitter.clear()
+        self._origin = time.perf_counter()
+        self._tick()
+
+    def _fill(self):
+        while len(self.upcoming) < self.window:
+            event = next(self._source, None)
+            if event is None:
                 break
+            self.upcoming.append(event)
+
+    def is_playing(self):
+        return self._origin is not None and self._paused_at is None
+
+    def elapsed(self):
+        if self._origin is None:
+            return 0.0
+        if self._paused_at is not None:
+            return self._paused_at - self._origin
+        return time.perf_counter() - self._origin
+
+    def pause(self):
+        if self.is_playing():
+            self.timer.stop()
+            self._paused_at = time.perf_counter()
+
+    def resume(self):
+        if self._paused_at is not None:
+            self._origin += time.perf_counter() - self._paused_at
+            self._paused_at = None
+            self._tick()
+
+    def stop(self):
+        self.timer.stop()
+        self._origin = None
+        self._paused_at = None
+
+    def seek(self, seconds):
+        # Repart du premier événement à partir de `seconds`, en lecture comme en pause.
+        # Sur un flux on ne peut qu'avancer : les événements sautés sont consommés.
+        if self.events is not None:
+            lo, hi = 0, len(self.events)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.events[mid][0] < seconds:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            self._source = islice(self.events, lo, None)
+            self.upcoming.clear()
+        else:
+            self._fill()
+            while self.upcoming and self.upcoming[0][0] < seconds:
+                self.upcoming.popleft()
+                self._fill()
+        now = time.perf_counter()
+        if self._paused_at is not None:
+            self._origin = self._paused_at - seconds
+        elif self._origin is not None:
+            self._origin = now - seconds
+            self._tick()
+
+    def _tick(self):
+        if not self.is_playing():
+            return
+        now = self.elapsed()
+        # Joue tous les événements dus (avec une petite avance), puis réarme un seul timer
+        self._fill()
+        while self.upcoming and self.upcoming[0][0] <= now + self.lookahead:
+            event = self.upcoming.popleft()
+            self.jitter.append(self.elapsed() - event[0])
+            self.dispatch(*event[1:])
+            self._fill()
+
+        if not self.upcoming:
+            self.stop()
+            self.finished.emit()
+            return
+        delay = self.upcoming[0][0] - self.elapsed()
+        self.timer.start(max(0, int(delay * 1000)))
+
+    def jitter_stats(self):
+        # Retard de déclenchement par rapport au temps prévu, en millisecondes
+        if not self.jitter:
+            return {"count": 0}
+        late = sorted(j * 1000 for j in self.jitter)
+        return {
+            "count": len(late),
+            "mean_ms": sum(late) / len(late),
+            "p95_ms": late[min(len(late) - 1, int(0.95 * len(late)))],
+            "max_ms": late[-1],
+            "min_ms": late[0],
+        }
+
+
+class SynthesisService(QObject):
+    # Synthèse des notes sur un pool de threads : sur une note absente du cache, le thread de
+    # l'interface ne fait que déposer la demande ; le son rendu revient par le signal `ready`
+    # et est joué dans le thread de l'interface. Une note déjà en cours de rendu n'est pas
+    # rendue une seconde fois, mais chaque demande est jouée : à l'arrivée du son, les suivantes
+    # gardent leur décalage par rapport à la première. Seules les demandes à moins de MERGE_WINDOW
+    # de la précédente jouée (rebond, double déclenchement) sont fusionnées.
+    MERGE_WINDOW = 0.03  # secondes
+    ready = pyqtSignal(object, object)  # clé (instrument, fréquence, durée), (buffer, Sound)
+    failed = pyqtSignal(object, str)
+
+    def __init__(self, player, workers=2, parent=None):
+        super().__init__(parent)
+        self.player = player
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="synthesis")
+        self.pending = {}  # clé -> instants des demandes en attente de ce rendu
+        self.requests = 0
+        self.deduplicated = 0  # demandes servies par un rendu déjà en cours
+        self.merged = 0  # demandes fusionnées avec la précédente (MERGE_WINDOW)
+        self.ready.connect(self._deliver)
+        self.failed.connect(self._forget)
+        player.synthesis = self.request
+
+    def request(self, instrument, frequency, duration):
+        key = (instrument, frequency, duration)
+        self.requests += 1
+        if key in self.pending:
+            self.deduplicated += 1
+            self.pending[key].append(time.perf_counter())
+            return
+        self.pending[key] = [time.perf_counter()]
+        self.pool.submit(self._render, key)
 
+    def _render(self, key):
+        # Thread du pool : synthèse (ou banque) + Sound, rien d'autre
+        try:
+            entry = self.player.tone_entry(*key)
+        except Exception as e:
+            self.failed.emit(key, str(e))
+            return
+        self.ready.emit(key, entry)
 
+    def _deliver(self, key, entry):
+        requests = self.pending.pop(key, None)
+        if requests is None:
+            return
+        first = last = requests[0]
+        self.player.play_entry(entry)
+        self.player.latency.record("async", time.perf_counter() - first)
+        for requested in requests[1:]:
+            if requested - last < self.MERGE_WINDOW:
+                self.merged += 1
+                continue
+            last = requested
+            QTimer.singleShot(int(round((requested - first) * 1000)), lambda: self.player.play_entry(entry))
+
+    def _forget(self, key, message):
+        self.pending.pop(key, None)
+        print(f"Synthesis failed for {key}: {message}", file=sys.stderr)
+
+    def shutdown(self):
+        self.player.synthesis = None
+        self.pending.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
 
 
 class PianoMainWindow(QMainWindow):
-    def __init__(self):
+    # Partitions à plusieurs pistes : mixage rendu sur des threads de fond, joué une fois prêt
+    arrangement_ready = pyqtSignal(object)
+    arrangement_failed = pyqtSignal(str)
+
+    def __init__(self, latency_report=None):
         super().__init__()
+        self.latency_report = latency_report
         self.setWindowTitle("🎹 Multi-Instrument Piano")
         self.settings = QSettings("PyQtPiano", "UserSettings")
         self.octaves = self.settings.value("octaves", 2, type=int)
         self.instrument = "piano"
-        self.player = MusicPlayer()
+        # lazy : pygame et la sortie son sont initialisés après l'affichage de la fenêtre
+        # Banques de sons dans le cache de l'utilisateur, pas à côté des sources ; le pré-calcul
+        # complet (toutes les notes de tous les instruments) est à activer avec le réglage warm_up
+        cache_root = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation)
+        self.bank_dir = os.path.join(cache_root, "PyQtPiano", "sample_bank") if cache_root else None
+        self.player = MusicPlayer(
+            warm_up=self.settings.value("warm_up", False, type=bool),
+            bank_dir=self.bank_dir,
+            streaming=self.settings.value("streaming", False, type=bool),
+            lazy=True
+        )
         self.is_recording = False
         self._recording_block = False
-        self.recorded_notes = []
+        # Notes tenues au clavier (touche Qt -> LiveVoice), relâchées par keyReleaseEvent
+        self.held_notes = {}
+        # Prise en cours / dernière prise : journal binaire .rec écrit au fil de l'eau
+        self.recorder = None
+        self.recording_path = None
         self.record_start_time = None
+        self.sequencer = Sequencer(self.play_instrument_note, self)
+        # Les notes absentes du cache sont rendues hors du thread de l'interface
+        self.synthesis = SynthesisService(self.player, parent=self)
+        self.arrangement_ready.connect(self.player.play_entry)
+        self.arrangement_failed.connect(lambda message: QMessageBox.critical(self, "Error", message))
         self.init_ui()
 
     def init_ui(self):
@@ -332,17 +941,21 @@ class PianoMainWindow(QMainWindow):
         self.piano_widget.get_current_instrument = lambda: self.instrument
         self.xylophone_widget = XylophoneWidget(self.player, self.record_note)
         self.video_game_widget = VideoGameWidget(self.player, self.record_note)
+        self.guitar_widget = GuitarWidget(self.player, self.record_note)
+        self.drum_widget = DrumWidget(self.player, self.bank_dir)
 
         self.stack.addWidget(self.piano_widget)
         self.stack.addWidget(self.xylophone_widget)
         self.stack.addWidget(self.video_game_widget)
+        self.stack.addWidget(self.guitar_widget)
+        self.stack.addWidget(self.drum_widget)
 
         # Instrument buttons
         instrument_buttons = QHBoxLayout()
-        for i, name in enumerate(["Piano", "Xylophone", "Video Game"]):
+        for i, name in enumerate(["Piano", "Xylophone", "Video Game", "Guitar", "Drums"]):
             btn = QPushButton(name)
             btn.setFixedWidth(120)
-            btn.clicked.connect(lambda _, idx=i, label=name.lower(): self.switch_instrument(idx, label))
+            btn.clicked.connect(lambda _, idx=i, label=name.lower().replace(" ", "_"): self.switch_instrument(idx, label))
             instrument_buttons.addWidget(btn)
         instrument_buttons.addStretch()
 
@@ -372,6 +985,7 @@ class PianoMainWindow(QMainWindow):
         self.add_toolbar_action(toolbar, "🎤 Record", "Ctrl+R", self.start_recording)
         self.add_toolbar_action(toolbar, "⏹ Stop", "Ctrl+S", self.stop_recording)
         self.add_toolbar_action(toolbar, "🔁 Play", "Ctrl+P", self.play_recording)
+        self.add_toolbar_action(toolbar, "💾 Export MIDI", "Ctrl+E", self.export_midi)
         self.add_toolbar_action(toolbar, "❌ Quit", "Ctrl+Q", self.close)
 
         self.timeline = RecordingTimeline()
@@ -394,6 +1008,15 @@ class PianoMainWindow(QMainWindow):
 
         self.switch_instrument(0, "piano") 
 
+    def closeEvent(self, event):
+        if self.latency_report:
+            self.player.latency.dump(self.latency_report)
+        if self.recorder:
+            self.recorder.close()
+        self.synthesis.shutdown()
+        self.player.close()
+        super().closeEvent(event)
+
     def add_toolbar_action(self, toolbar, text, shortcut, callback):
         action = QAction(text, self)
         action.setShortcut(shortcut)
@@ -414,12 +1037,7 @@ class PianoMainWindow(QMainWindow):
     def change_octaves(self, value):
         self.octaves = value
         self.settings.setValue("octaves", value)
-        self.stack.removeWidget(self.piano_widget)
-        self.piano_widget = PianoWidget(self.player, self.record_note, value)
-        self.piano_widget.get_current_instrument = lambda: self.instrument
-        self.stack.insertWidget(0, self.piano_widget)
-        self.stack.setCurrentIndex(0)
-        self.instrument = "piano"
+        self.piano_widget.set_octaves(value)
 
     def keyPressEvent(self, event):
         key_map = {
@@ -429,78 +1047,110 @@ class PianoMainWindow(QMainWindow):
             Qt.Key_W: "C#4", Qt.Key_S: "D#4", Qt.Key_F: "F#4", Qt.Key_G: "G#4", Qt.Key_H: "A#4"
         }
         note = key_map.get(event.key())
-        if note:
+        if note and not event.isAutoRepeat():
+            # Mesure de latence : de l'appui sur la touche jusqu'à la sortie son
+            self.player.latency.begin()
             self._recording_block = True 
-            if self.instrument == "piano":
-                self.piano_widget.play_note(note)
-            elif self.instrument == "xylophone":
-                self.xylophone_widget.play(note)
-            elif self.instrument == "video_game":
-                self.video_game_widget.play(note)
+            # Note tenue jusqu'au relâchement de la touche quand le mixeur streaming est actif,
+            # sinon note d'une seconde comme avant
+            voice = self.player.note_on(self.instrument, note_frequency(note))
+            if voice is not None:
+                self.release_note(event.key())
+                self.held_notes[event.key()] = voice
+            self.play_instrument_note(note, sound=voice is None)
             self._recording_block = False  
+            self.player.latency.end()
             self.record_note(note)   
         super().keyPressEvent(event)
 
+    def keyReleaseEvent(self, event):
+        if not event.isAutoRepeat():
+            self.release_note(event.key())
+        super().keyReleaseEvent(event)
+
+    def release_note(self, key):
+        voice = self.held_notes.pop(key, None)
+        if voice is not None:
+            self.player.note_off(voice)
+
+    def changeEvent(self, event):
+        # Fenêtre désactivée : plus de keyReleaseEvent à attendre, on relâche tout
+        if event.type() == QEvent.ActivationChange and not self.isActiveWindow():
+            for key in list(self.held_notes):
+                self.release_note(key)
+        super().changeEvent(event)
+
+    def play_instrument_note(self, note, instrument=None, sound=True):
+        # Sans instrument précisé (partitions), on joue sur l'instrument actif
+        instrument = instrument or self.instrument
+        if instrument == "piano":
+            self.piano_widget.play_note(note, sound)
+        elif instrument == "xylophone":
+            self.xylophone_widget.play(note)
+        elif instrument == "video_game":
+            self.video_game_widget.play(note, sound)
+        elif instrument == "guitar":
+            self.guitar_widget.play(note, sound)
+        elif instrument == "drums":
+            self.drum_widget.play(note, sound)
+
     def record_note(self, note):
+        # La boîte à rythmes n'est pas enregistrée : ses touches ne sont ni écrites ni signalées
+        if self.instrument == "drums":
+            return
         if self.is_recording and not self._recording_block:
             timestamp = round(time.time() - self.record_start_time, 3)
-            self.recorded_notes.append({
-                "note": note,
-                "time": timestamp,
-                "instrument": self.instrument
-            })
-            self.timeline.add_event(note, timestamp, self.instrument)
+            # Une note refusée est signalée par le writer
+            if self.recorder.append(timestamp, note, self.instrument):
+                self.timeline.add_event(note, timestamp, self.instrument)
 
 
 
     def open_score(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "Open Score", "", "Text Files (*.txt)")
+        file_name, _ = QFileDialog.getOpenFileName(self, "Open Score", "",
+                                                   "Text Files (*.txt);;Recordings (*.rec *.json);;MIDI Files (*.mid *.midi)")
         if not file_name:
             return
 
         try:
-            with open(file_name, 'r') as f:
-                lines = f.readlines()
-            time_offset = 0
-            tempo = 1000  
-
-            for line in lines:
-                parts = line.strip().split()
-                if len(parts) != 2:
-                    continue
-
-                note, duration_str = parts
-                try:
-                    duration = float(duration_str)
-                except ValueError:
-                    continue
-
-                if note in ['0', 'Unknown']:
-                    time_offset += duration * tempo
-                    continue
-
-                if note not in note_to_frequency:
-                    print(f"Skipping unknown note: {note}")
-                    continue
-
-                def play_later(n=note):
-                    if self.instrument == "piano":
-                        self.piano_widget.play_note(n)
-                    elif self.instrument == "xylophone":
-                        self.xylophone_widget.play(n)
-                    elif self.instrument == "video_game":
-                        self.video_game_widget.play(n)
-
-                QTimer.singleShot(int(time_offset), play_later)
-                time_offset += duration * tempo
-
+            if file_name.endswith((".rec", ".json")):
+                # Enregistrement : affiché dans la frise et rejoué avec ses propres instruments
+                events = load_recording(file_name)
+                self.timeline.set_events(events)
+                self.sequencer.play(events)
+            elif file_name.endswith((".mid", ".midi")):
+                # Chaque canal joue sur l'instrument de son programme, le canal 10 sur la boîte à rythmes
+                self.sequencer.play(midi_events(load_midi(file_name)))
+            elif is_multitrack(file_name):
+                self.play_arrangement(file_name)
+            elif os.path.getsize(file_name) > STREAM_THRESHOLD:
+                # Très grosse partition : lecture en flux, la musique démarre tout de suite
+                self.sequencer.play_stream(stream_score(file_name, instrument=None))
+            else:
+                self.sequencer.play(compile_score(file_name).to_events(instrument=None))
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Could not open file:\n{str(e)}")
 
 
+    def play_arrangement(self, file_name):
+        # Lecture et synthèse hors du thread de l'interface : chaque piste sur son propre worker
+        tracks = load_tracks(file_name, self.instrument)
+
+        def render():
+            try:
+                # Le son int16 est prêt ici : le thread de l'interface ne fait que lancer la lecture
+                self.arrangement_ready.emit(self.player.mix_entry(render_tracks(tracks, self.player)))
+            except Exception as e:
+                self.arrangement_failed.emit(f"Could not render file:\n{str(e)}")
+
+        threading.Thread(target=render, name="arrangement", daemon=True).start()
+
     def start_recording(self):
+        if self.recorder:
+            self.recorder.close()
+        self.recording_path = f"recording_{datetime.now().strftime('%H%M%S')}.rec"
+        self.recorder = RecordingWriter(self.recording_path)
         self.is_recording = True
-        self.recorded_notes = []
         self.record_start_time = time.time()
         self.timeline.clear()
         QMessageBox.information(self, "Recording", "Recording started...")
@@ -509,34 +1159,58 @@ class PianoMainWindow(QMainWindow):
         if not self.is_recording:
             return
         self.is_recording = False
-        filename = f"recording_{datetime.now().strftime('%H%M%S')}.json"
-        with open(filename, 'w') as f:
-            json.dump(self.recorded_notes, f, indent=4)
-        QMessageBox.information(self, "Recording Saved", f"Recording saved to {filename}")
+        self.recorder.close()
+        QMessageBox.information(self, "Recording Saved", f"Recording saved to {self.recording_path}")
 
     def play_recording(self):
-        if not self.recorded_notes:
+        # Relecture du journal par projection mémoire (possible même pendant la prise)
+        recording = Recording(self.recording_path) if self.recording_path else None
+        if not recording:
             QMessageBox.warning(self, "No recording", "No notes to play.")
             return
 
-        for note_data in self.recorded_notes:
-            delay = int(note_data["time"] * 1000)
-            note = note_data["note"]
-            instr = note_data.get("instrument", "piano")
+        self.sequencer.play(recording.events())
+
+    def export_midi(self):
+        if not self.recording_path:
+            QMessageBox.warning(self, "No recording", "No notes to export.")
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export MIDI", os.path.splitext(self.recording_path)[0] + ".mid",
+                                                   "MIDI Files (*.mid)")
+        if not file_name:
+            return
+        try:
+            # Le journal est relu par projection mémoire et écrit en un seul passage
+            count = write_midi(file_name, Recording(self.recording_path))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Could not export MIDI:\n{str(e)}")
+            return
+        QMessageBox.information(self, "MIDI exported", f"{count} notes saved to {file_name}")
+
+
+def option_value(name):
+    if name in sys.argv[1:-1]:
+        return sys.argv[sys.argv.index(name) + 1]
+    return None
 
-            def play_later(n=note, i=instr):
-                if i == "piano":
-                    self.piano_widget.play_note(n)
-                elif i == "xylophone":
-                    self.xylophone_widget.play(n)
-                elif i == "video_game":
-                    self.video_game_widget.play(n)
 
-            QTimer.singleShot(delay, play_later)
+def on_first_frame(window):
+    startup_marks.append(("first frame", time.perf_counter()))
+    budget = option_value("--startup-budget")
+    if "--startup-report" in sys.argv or budget is not None:
+        report, total = startup_report(startup_marks, float(budget) if budget is not None else None)
+        print(report, file=sys.stderr)
+    # Le son (import de pygame, ouverture du mixer) se prépare ensuite en tâche de fond
+    window.player.init_audio_async()
 
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    window = PianoMainWindow()
+    startup_marks.append(("QApplication", time.perf_counter()))
+    # Statistiques de latence touche -> son écrites en JSON à la fermeture
+    latency_report = option_value("--latency-report")
+    window = PianoMainWindow(latency_report)
+    startup_marks.append(("main window", time.perf_counter()))
     window.show()
+    QTimer.singleShot(0, lambda: on_first_frame(window))
     sys.exit(app.exec_())